@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+from smartcard.CardMonitoring import CardMonitor, CardObserver
+from reader import eIDReader
+from connection import eIDBackoff, eIDCardRemovedError, eIDReaderGoneError, eIDTransientError
+import asyncio
+
+class AsyncEIDReader:
+
+    # Construct - takes the same arguments as eIDReader, the reader is created on the first read
+    # retries and retry_delay are used when the card does not respond - the wait between tries does not block the event loop
+    # Pass a store (eIDContactStore) to limit the amount of kept contacts
+    def __init__(self, name = "", reader = None, retries = 3, retry_delay = 0.25, transport = None, store = None):
+        self._name = name
+        self._store = store
+        self._bound_reader = reader
+        self._transport = transport
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._reader = None
+
+        # Every reader has one worker thread - PC/SC calls run there so they never block the event loop, and never interleave
+        self._worker = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = f"eIDReader {name}")
+
+    # Methods
+
+    ## Returns the blocking eIDReader - None if no card was read yet
+    @property
+    def reader(self):
+        return self._reader
+
+    ## Reads all data from the current inserted card - returns true for success - raises exception for error
+    async def read_card(self):
+        await self.run_session()
+        return True
+
+    ## Reads the files of a session (see eIDReader.session) - returns the read contact - raises exception for error
+    async def run_session(self, files = None, selected_data = None):
+        return await self._call(lambda reader: reader.session(files, selected_data).run())
+
+    ## Reads the "Registre national" file - returns true for success - raises exception for error
+    async def read_registre_national(self, selected_data = None):
+        return await self._call(lambda reader: reader.read_registre_national(selected_data))
+
+    ## Reads the "Address" file - returns true for success - raises exception for error
+    async def read_address(self, selected_data = None, card_number = None):
+        return await self._call(lambda reader: reader.read_address(selected_data, card_number))
+
+    ## Reads the "Photo" file - returns true for success - raises exception for error
+    async def read_photo(self, card_number = None):
+        return await self._call(lambda reader: reader.read_photo(card_number))
+
+    ## Reads the "Photo" file and writes every chunk to file as soon as it is received - returns the amount of written bytes - raises exception for error
+    ## file is written on the worker thread of the reader
+    async def read_photo_to(self, file, card_number = None):
+        return await self._call(lambda reader: reader.read_photo_to(file, card_number))
+
+    ## Reads the "Photo" file - yields every chunk as soon as it is received, use as "async for chunk in reader.iter_photo()"
+    ## A chunk is read on the worker thread, the event loop is not blocked while waiting for the card - raises exception for error
+    async def iter_photo(self, card_number = None):
+        if not self._reader:
+            self._reader = await self._run(self._create_reader)
+        chunks = self._reader.iter_photo(card_number)
+        try:
+            while True:
+                chunk = await self._run(next, chunks, None)
+                if chunk == None:
+                    return
+                yield chunk
+        finally:
+            await self._run(chunks.close)
+
+    ## Returns the last read contact
+    def get_last_read(self):
+        if not self._reader:
+            raise Exception(f"No eID contacts read yet - please read one first")
+        return self._reader.get_last_read()
+
+    ## Reads every card that is inserted in the card reader - use as "async for eID_contact in reader.cards()"
+    ## Cards that fail to read are skipped, unless raise_errors is true
+    async def cards(self, files = None, selected_data = None, raise_errors = False):
+        loop = asyncio.get_running_loop()
+        inserted = asyncio.Queue()
+
+        # The card monitor runs its own thread - insertions are passed to the event loop
+        observer = _InsertionObserver(loop, inserted)
+        monitor = CardMonitor()
+        monitor.addObserver(observer)
+        try:
+            while True:
+                reader_name = await inserted.get()
+                if not self._matches(reader_name):
+                    continue
+                try:
+                    yield await self._call(lambda reader: reader.session(files, selected_data).run(), reconnect = True)
+                except Exception:
+                    if raise_errors:
+                        raise
+        finally:
+            monitor.deleteObserver(observer)
+
+    ## Closes the reader
+    async def close(self):
+        if self._reader:
+            await self._run(self._reader._disconnect)
+        self._worker.shutdown(wait = False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Runs a blocking method on the worker of this reader
+    async def _run(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._worker, method, *args)
+
+    # Calls method with the blocking eIDReader on the worker - retries with a non blocking wait when the card does not respond
+    # Only errors of the connection are retried - other errors (e.g. a file not on the card or a photo that does not match) are raised at once
+    async def _call(self, method, reconnect = False):
+        for retry in range(self._retries, 0, -1):
+            try:
+                if not self._reader:
+                    self._reader = await self._run(self._create_reader)
+                elif reconnect:
+                    await self._run(self._reader._init_reader)
+                return await self._run(method, self._reader)
+            except (eIDCardRemovedError, eIDReaderGoneError, eIDTransientError):
+                if retry <= 1:
+                    raise
+
+            # Wait to try again - a new eID may has been inserted, so reconnect
+            await asyncio.sleep(self._retry_delay)
+            reconnect = True
+
+    # Creates the blocking eIDReader - the reader does not wait between tries itself, waiting is done on the event loop
+    def _create_reader(self):
+        reader = eIDReader(self._name, self._bound_reader, store = self._store, transport = self._transport)
+        reader.backoff = eIDBackoff(tries = 1)
+        return reader
+
+    # Checks if a card was inserted in the card reader of this object
+    def _matches(self, reader_name):
+        if self._reader and self._reader._transport.name:
+            return reader_name == self._reader._transport.name
+        if self._bound_reader:
+            return reader_name == str(self._bound_reader)
+        return reader_name.lower().startswith(self._name.lower())
+
+## Passes inserted cards from the card monitor thread to an asyncio queue
+class _InsertionObserver(CardObserver):
+
+    def __init__(self, loop, queue):
+        self._loop = loop
+        self._queue = queue
+
+    def update(self, observable, actions):
+        added_cards, _ = actions
+        for card in added_cards:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, str(card.reader))
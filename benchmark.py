@@ -0,0 +1,399 @@
+from contact import eIDContact
+from export import export_contacts
+from reader import eIDReader
+from simulator import eIDSimulatedCard, SimulatedTransport, dummy_photo
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Benchmarks for the read path - these run against a simulated card so no card reader is needed
+
+# Decoded "Registre national" and "Address" data of a dummy card - as returned by eIDReader._decode_data
+_DECODED_DATA = {
+    "card number": "592123456789",
+    "chip number": "534c494e33660013931d0c9ab1a7a4f0",
+    "card validity begin": "01.02.2020",
+    "card validity end": "01.02.2030",
+    "card delivery municipality": "Antwerpen",
+    "national number": "85010112345",
+    "name": "Peeters",
+    "two first given names": "Jan Pieter",
+    "first letter of third name": "K",
+    "nationality": "Belg",
+    "birthplace": "Gent",
+    "birthdate": "01 JAN 1985",
+    "sex": "M",
+    "noble condition": "",
+    "document type": "1",
+    "special status": "0",
+    "hash photo": "9f1e7c4a2b8d3e6f0a1b2c3d4e5f60718293a4b5",
+    "street": "Kerkstraat 1",
+    "zip_code": "9000",
+    "municipality": "Gent"
+}
+
+# "Registre national" and "Address" file of the dummy card - as a list of ints like a response of the card
+_RN_PAYLOAD = list(eIDSimulatedCard(_DECODED_DATA).files[eIDSimulatedCard.REGISTRE_NATIONAL])
+_ADDRESS_PAYLOAD = list(eIDSimulatedCard().files[eIDSimulatedCard.ADDRESS])
+
+# Runs method rounds times - returns operations per second
+def _ops_per_second(method, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        method()
+    return rounds / (time.perf_counter() - start)
+
+# Creates a reader with a simulated card holding the given photo
+def _reader(photo):
+    return eIDReader(transport = SimulatedTransport(eIDSimulatedCard(photo = photo)))
+
+# Benchmarks a full card read on a simulated card - APDUs per read and simulated seconds per read for a per-APDU latency
+def benchmark_read_card(latency = 0.005, jitter = 0.001, rounds = 50):
+    transport = SimulatedTransport(latency = latency, jitter = jitter, sleep = False, seed = 1)
+    reader = eIDReader(transport = transport)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        reader.read_card()
+    elapsed = time.perf_counter() - start
+
+    # Peak memory of one full read - the file sizes are learned already, like on a desk that reads cards all day
+    tracemalloc.start()
+    reader.read_card()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "apdus_per_read": transport.apdu_count / (rounds + 1),
+        "simulated_ms_per_read": (transport.simulated_seconds + elapsed) / (rounds + 1) * 1000,
+        "cpu_ms_per_read": elapsed / rounds * 1000,
+        "peak_bytes_per_read": peak
+    }
+
+# Benchmarks the end-to-end latency of a full read for several per-APDU delays - with T=0 (short reads) and T=1 (extended length reads)
+def benchmark_latency(latencies = (0.001, 0.005, 0.010, 0.020), protocols = ("T0", "T1"), rounds = 20):
+    results = []
+    for protocol in protocols:
+        for latency in latencies:
+            transport = SimulatedTransport(latency = latency, sleep = False, protocol = protocol, name = f"Simulated eID reader {protocol}")
+            reader = eIDReader(transport = transport)
+            reader.read_card()
+
+            # First read learns the file sizes and probes the card reader - only the reads after that are measured
+            apdu_count = transport.apdu_count
+            simulated_seconds = transport.simulated_seconds
+            start = time.perf_counter()
+            for _ in range(rounds):
+                reader.read_card()
+            elapsed = time.perf_counter() - start
+            results.append({
+                "protocol": protocol,
+                "apdu_latency_ms": latency * 1000,
+                "apdus_per_read": (transport.apdu_count - apdu_count) / rounds,
+                "simulated_ms_per_read": (transport.simulated_seconds - simulated_seconds + elapsed) / rounds * 1000
+            })
+    return results
+
+# Counts the APDUs the photo loop used before the adaptive photo reader (256 byte chunks, length decremented by one at the end)
+def _legacy_photo_apdu_count(photo):
+    card = eIDSimulatedCard(photo = photo)
+    card.transmit([0x00, 0xA4, 0x08, 0x0C, 0x06, 0x3F, 0x00, 0xDF, 0x01, 0x40, 0x35])
+    count = 1
+    offset = 0
+    length = 256
+    while length > 0:
+        response, _, _ = card.transmit([0x00, 0xB0, offset >> 8, offset & 0xFF, length & 0xFF])
+        count += 1
+        if len(response) >= 2 and response[-2:] == [0xFF, 0xD9]:
+            return count
+        if len(response) <= 0:
+            length -= 1
+        else:
+            offset += 256
+    return count
+
+# Counts the APDUs of read_photo without a card number on a card that was not read before - the card number and "hash photo" are read as well
+def _standalone_photo_apdu_count(photo):
+    reader = _reader(photo)
+    reader.read_photo()
+    return reader._apdu_count
+
+# Benchmarks the photo read - APDU count before and after, and the time per read
+def benchmark_photo(sizes = (2048, 3063, 4137), rounds = 200):
+    results = []
+    for size in sizes:
+        photo = dummy_photo(size)
+        reader = _reader(photo)
+
+        # The card is read first, so the "hash photo" is known and only the photo is measured (like apdus_before)
+        reader.read_registre_national()
+        card_number = reader.get_last_read().card_number
+
+        # First read probes the end of the file - the next reads use the learned file size
+        count = reader._apdu_count
+        reader.read_photo(card_number)
+        first_read = reader._apdu_count - count
+        count = reader._apdu_count
+        reader.read_photo(card_number)
+        repeat_read = reader._apdu_count - count
+
+        # Time the photo read
+        start = time.perf_counter()
+        for _ in range(rounds):
+            reader.read_photo(card_number)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "size": size,
+            "apdus_before": _legacy_photo_apdu_count(photo),
+            "apdus_first_read": first_read,
+            "apdus_repeat_read": repeat_read,
+            "apdus_standalone_read": _standalone_photo_apdu_count(photo),
+            "ms_per_read": elapsed / rounds * 1000
+        })
+    return results
+
+# Benchmarks the contact - memory per contact and save/serialize operations per second
+def benchmark_contact(contacts = 1000, rounds = 10000, photo_size = 3063):
+    photo = dummy_photo(photo_size)
+
+    # Memory per contact - with and without photo, every contact gets its own copy of the photo like when read from a card
+    results = {}
+    for key, with_photo in (("bytes_per_contact", False), ("bytes_per_contact_with_photo", True)):
+        tracemalloc.start()
+        kept = []
+        for index in range(contacts):
+            contact = eIDContact(str(index))
+            contact._save(dict(_DECODED_DATA, photo = bytearray(photo)) if with_photo else _DECODED_DATA)
+            kept.append(contact)
+        current, peak = tracemalloc.get_traced_memory()
+        results[key] = current // contacts
+        results["peak_" + key] = peak // contacts
+        tracemalloc.stop()
+
+    # Save and serialize
+    contact = eIDContact(_DECODED_DATA["card number"])
+    contact._save(dict(_DECODED_DATA, photo = photo))
+    results["save_per_second"] = _ops_per_second(lambda: contact._save(_DECODED_DATA), rounds)
+    results["to_dict_per_second"] = _ops_per_second(contact.to_dict, rounds)
+    results["to_json_per_second"] = _ops_per_second(contact.to_json, rounds)
+    return results
+
+# Benchmarks the TLV decoder - decode operations per second of the "Registre national" and "Address" file
+def benchmark_decode(rounds = 20000):
+    reader = _reader(dummy_photo(2048))
+    return {
+        "rn_per_second": _ops_per_second(lambda: reader._decode_data(_RN_PAYLOAD, reader._REGISTRE_NATIONAL_MAPPING), rounds),
+        "rn_card_number_per_second": _ops_per_second(lambda: reader._get_card_number(_RN_PAYLOAD, reader._REGISTRE_NATIONAL_MAPPING), rounds),
+        "rn_selected_per_second": _ops_per_second(lambda: reader._decode_data(_RN_PAYLOAD, reader._REGISTRE_NATIONAL_MAPPING, [ "card number", "hash photo" ]), rounds),
+        "address_per_second": _ops_per_second(lambda: reader._decode_data(_ADDRESS_PAYLOAD, reader._ADDRESS_MAPPING), rounds)
+    }
+
+# Benchmarks the export - contacts per second and peak memory of NDJSON and CSV with photos as side files, against a to_json loop
+def benchmark_export(contacts = 2000, photo_size = 3063):
+    photo = dummy_photo(photo_size)
+    kept = []
+    for index in range(contacts):
+        contact = eIDContact(str(index))
+        contact._save(dict(_DECODED_DATA, card_number = str(index), photo = bytes(photo)))
+        kept.append(contact)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        exports = (
+            ("to_json", lambda: [contact.to_json() for contact in kept]),
+            ("ndjson", lambda: export_contacts(kept, os.path.join(directory, "contacts.ndjson"), photo_dir = os.path.join(directory, "photos"))),
+            ("csv", lambda: export_contacts(kept, os.path.join(directory, "contacts.csv"), photo_dir = os.path.join(directory, "photos"))),
+        )
+        for name, method in exports:
+            tracemalloc.start()
+            start = time.perf_counter()
+            method()
+            elapsed = time.perf_counter() - start
+            results[f"{name}_per_second"] = contacts / elapsed
+            results[f"{name}_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return results
+
+# Simulated transport that counts APDUs sent while another APDU is still being answered - this never happens when card access is serialized
+class _ExclusiveTransport(SimulatedTransport):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._busy = threading.Lock()
+        self.overlapping_apdus = 0
+
+    def transmit(self, apdu):
+        if not self._busy.acquire(blocking = False):
+            self.overlapping_apdus += 1
+            return super().transmit(apdu)
+        try:
+            return super().transmit(apdu)
+        finally:
+            self._busy.release()
+
+# Stress test - many threads share one reader and call random read methods, every result is checked against the simulated card
+def benchmark_threads(threads = 16, calls = 400, latency = 0.0002, seed = 1):
+    card = eIDSimulatedCard(photo = dummy_photo(3063))
+    transport = _ExclusiveTransport(card, latency = latency)
+    reader = eIDReader(transport = transport)
+    methods = [
+        lambda: reader.read_card(),
+        lambda: reader.read_address(),
+        lambda: reader.read_photo(),
+        lambda: reader.read_card_number() == "592123456789" or _fail("card number"),
+        lambda: reader.read_file("CA CERTIFICATE") == card.files[eIDSimulatedCard.CA_CERTIFICATE] or _fail("certificate"),
+        lambda: reader.session(["ADDRESS"]).run(),
+    ]
+    choices = random.Random(seed).choices(methods, k = calls)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = threads) as pool:
+        errors = [future.exception() for future in [pool.submit(method) for method in choices]]
+    elapsed = time.perf_counter() - start
+
+    # Check the results - a failed call or an APDU sent while another one was answered fails the stress test
+    errors = [error for error in errors if error]
+    if errors:
+        raise Exception(f"Stress test failed - {len(errors)} of {calls} calls raised an exception") from errors[0]
+    if transport.overlapping_apdus:
+        raise Exception(f"Stress test failed - {transport.overlapping_apdus} APDUs were sent while another APDU was answered")
+
+    # Check the contact - it was updated by every thread
+    contact = reader.get_last_read()
+    if contact.street != "Kerkstraat 1" or contact.name != "Peeters" or contact.photo_bytes != card.files[eIDSimulatedCard.PHOTO] or not contact.photo_verified:
+        _fail("contact")
+    return {
+        "calls": calls,
+        "calls_per_second": calls / elapsed,
+        "apdus": transport.apdu_count,
+        "shared_reads": reader._shared_reads,
+        "contacts": len(reader.contacts)
+    }
+
+# Raises an exception for a failed check of the stress test
+def _fail(check):
+    raise Exception(f"Stress test failed - {check} does not match the simulated card")
+
+# Measures the startup of a fresh process - run by benchmark_startup in a new interpreter, prints the results as JSON
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from reader import eIDReader
+imported = time.perf_counter()
+reader = eIDReader()
+constructed = time.perf_counter()
+print(json.dumps({ "import_ms": (imported - start) * 1000, "construct_ms": (constructed - imported) * 1000, "smartcard_imported": "smartcard" in sys.modules }))
+"""
+
+# Benchmarks the startup - importing eIDReader and constructing it in a fresh process (no card reader is looked up), and warmup on a simulated card
+def benchmark_startup(rounds = 5, latency = 0.005):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = [json.loads(subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT], cwd = directory, capture_output = True, text = True, check = True).stdout) for _ in range(rounds)]
+
+    # Warmup connects and probes the card reader - the first read after warmup only sends the APDUs of the read
+    transport = SimulatedTransport(latency = latency, sleep = False)
+    reader = eIDReader(transport = transport)
+    start = time.perf_counter()
+    reader.warmup()
+    warmup_ms = (time.perf_counter() - start) * 1000
+    apdus_warmup = transport.apdu_count
+    reader.read_card()
+    return {
+        "import_ms": min(result["import_ms"] for result in results),
+        "construct_ms": min(result["construct_ms"] for result in results),
+        "smartcard_imported": sum(result["smartcard_imported"] for result in results),
+        "warmup_ms": warmup_ms,
+        "apdus_warmup": apdus_warmup,
+        "apdus_first_read": transport.apdu_count - apdus_warmup,
+    }
+
+# Benchmarks by name - run in this order
+BENCHMARKS = {
+    "read_card": benchmark_read_card,
+    "latency": benchmark_latency,
+    "photo": benchmark_photo,
+    "contact": benchmark_contact,
+    "decode": benchmark_decode,
+    "export": benchmark_export,
+    "threads": benchmark_threads,
+    "startup": benchmark_startup,
+}
+
+# Runs the benchmarks (all when names is empty) - returns the results by benchmark name and the environment of the run, ready to be written as JSON
+def run_benchmarks(names = None):
+    names = names or list(BENCHMARKS)
+    invalid_names = set(names) - set(BENCHMARKS)
+    if invalid_names:
+        raise ValueError(f"Invalid benchmarks found: {', '.join(invalid_names)}. Allowed benchmarks are: {', '.join(BENCHMARKS)}.")
+    return {
+        "environment": _environment(),
+        "results": {name: BENCHMARKS[name]() for name in BENCHMARKS if name in names},
+    }
+
+# Returns the environment of a run - the commit makes it possible to compare runs across commits
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)), capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = "seconds"),
+    }
+
+# Flattens the results to "benchmark.key" (rows of a list are numbered, e.g. "photo.0.ms_per_read") - only numbers are kept
+def _flatten(value, prefix = ""):
+    if isinstance(value, dict):
+        return {key: number for name, item in value.items() for key, number in _flatten(item, f"{prefix}{name}.").items()}
+    if isinstance(value, list):
+        return {key: number for index, item in enumerate(value) for key, number in _flatten(item, f"{prefix}{index}.").items()}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+# Prints the results of a run - when a baseline run is given, the change against the baseline is printed as well
+def _print_run(run, baseline = None):
+    numbers = _flatten(run["results"])
+    baseline_numbers = _flatten(baseline["results"]) if baseline else {}
+    for name, result in run["results"].items():
+        print(name)
+        for row in (result if isinstance(result, list) else [result]):
+            print("  " + ", ".join(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}" for key, value in row.items()))
+    if baseline:
+        print(f"Compared with {baseline['environment'].get('commit') or 'baseline'}")
+        for key, value in numbers.items():
+            if key in baseline_numbers:
+                old = baseline_numbers[key]
+                change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+                print(f"  {key}: {old:.3f} -> {value:.3f} ({change})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks of the read path against a simulated card - no card reader is needed")
+    parser.add_argument("benchmarks", nargs = "*", help = f"benchmarks to run ({' '.join(BENCHMARKS)}), defaults to all")
+    parser.add_argument("--json", default = None, help = "write the results as JSON to this file, - for stdout")
+    parser.add_argument("--compare", default = None, help = "JSON file of an earlier run to compare with")
+    arguments = parser.parse_args()
+
+    run = run_benchmarks(arguments.benchmarks)
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare, encoding = "utf-8") as file:
+            baseline = json.load(file)
+    if arguments.json == "-":
+        print(json.dumps(run, indent = 4))
+    else:
+        _print_run(run, baseline)
+        if arguments.json:
+            with open(arguments.json, "w", encoding = "utf-8") as file:
+                json.dump(run, file, indent = 4)
@@ -0,0 +1,179 @@
+from decoder import decode_files
+from multiprocessing import Pool
+from collections import deque
+import argparse
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+
+# Extensions of the archived files of a card - a record is the group of files with the same name, e.g. 592123456789.rn, 592123456789.address and 592123456789.jpg
+FILE_EXTENSIONS = {
+    ".rn": "RN",
+    ".address": "ADDRESS",
+    ".photo": "PHOTO",
+    ".jpg": "PHOTO",
+}
+
+# Splits a path into the record id and the file of the record - returns None for files that are not part of a record
+def _split_path(path):
+    record_id, extension = os.path.splitext(path.replace("\\", "/").removeprefix("./"))
+    file = FILE_EXTENSIONS.get(extension.lower())
+    return (record_id, file) if file else None
+
+# Streams the records of a directory, zip archive or tar archive - yields (record id, { file: bytes })
+# Files are read when their record is yielded, so only one record is kept in memory
+def iter_records(source):
+    if os.path.isdir(source):
+        yield from _iter_directory(source)
+    elif zipfile.is_zipfile(source):
+        yield from _iter_zip(source)
+    elif tarfile.is_tarfile(source):
+        yield from _iter_tar(source)
+    else:
+        raise Exception(f"Could not read '{source}' - expected a directory, zip archive or tar archive")
+
+## Records of a directory - every directory is read in sorted order, the record id is the path relative to source
+def _iter_directory(source):
+    for directory, directories, files in os.walk(source):
+        directories.sort()
+        records = {}
+        for name in files:
+            split = _split_path(name)
+            if split:
+                records.setdefault(split[0], {})[split[1]] = os.path.join(directory, name)
+        for record_id in sorted(records):
+            files = {}
+            for file, path in records[record_id].items():
+                with open(path, "rb") as handle:
+                    files[file] = handle.read()
+            yield os.path.relpath(os.path.join(directory, record_id), source).replace("\\", "/"), files
+
+## Records of a zip archive - the members are grouped by record id first, their data is read per record
+def _iter_zip(source):
+    with zipfile.ZipFile(source) as archive:
+        records = {}
+        for member in archive.namelist():
+            split = _split_path(member)
+            if split:
+                records.setdefault(split[0], {})[split[1]] = member
+        for record_id in sorted(records):
+            yield record_id, {file: archive.read(member) for file, member in records[record_id].items()}
+
+## Records of a tar archive - a tar archive can only be read in order, so the files of a record have to follow each other
+def _iter_tar(source):
+    with tarfile.open(source, "r|*") as archive:
+        record_id, files = None, {}
+        for member in archive:
+            split = _split_path(member.name) if member.isfile() else None
+            if not split:
+                continue
+            if split[0] != record_id and files:
+                yield record_id, files
+                files = {}
+            record_id = split[0]
+            files[split[1]] = archive.extractfile(member).read()
+        if files:
+            yield record_id, files
+
+# Decodes a batch of records - runs in a worker process, returns the NDJSON lines (encoding JSON is done in the worker too) and the amount of errors
+# A record that can not be decoded is written with its error, so one broken dump does not stop the run
+def _decode_batch(batch, photos = True):
+    lines = []
+    errors = 0
+    for record_id, files in batch:
+        try:
+            if "RN" not in files:
+                raise Exception("Decode failed - the \"Registre national\" file is missing")
+            record = decode_files(files["RN"], files.get("ADDRESS"), files.get("PHOTO")).to_dict()
+            if not photos:
+                del record["photo"]
+            record = dict(id = record_id, **record)
+        except Exception as e:
+            record = { "id": record_id, "error": str(e) }
+            errors += 1
+        lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+    return lines, errors
+
+# Returns the ids of the records that are already in output - a line that was cut off by an interruption is removed
+def _read_done(output):
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as file:
+        end = 0
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            end += len(line)
+        file.truncate(end)
+    return done
+
+# Decodes every record of source with a pool of worker processes and writes them as NDJSON to output
+# When output exists the run is resumed - records that are already in output are skipped
+# progress is called with the statistics after every batch - returns the statistics (records, errors, skipped, seconds, records_per_second)
+def decode_archive(source, output, processes = None, batch_size = 500, photos = True, progress = None):
+    done = _read_done(output)
+    stats = { "records": 0, "errors": 0, "skipped": 0, "seconds": 0.0, "records_per_second": 0.0 }
+    start = time.perf_counter()
+
+    # Batches are created while the workers decode - only a few batches are pending, so the source is streamed
+    def batches():
+        batch = []
+        for record_id, files in iter_records(source):
+            if record_id in done:
+                stats["skipped"] += 1
+                continue
+            batch.append((record_id, files))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with Pool(processes) as pool, open(output, "a", encoding = "utf-8") as file:
+        pending = deque()
+        max_pending = 2 * (processes or os.cpu_count() or 1)
+
+        # Batches are written in the order they are read, so after an interruption every record before the last line is done
+        def write(result):
+            lines, errors = result
+            file.writelines(lines)
+            file.flush()
+            stats["records"] += len(lines)
+            stats["errors"] += errors
+            stats["seconds"] = time.perf_counter() - start
+            stats["records_per_second"] = stats["records"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            if progress:
+                progress(dict(stats))
+
+        for batch in batches():
+            pending.append(pool.apply_async(_decode_batch, (batch, photos)))
+            if len(pending) >= max_pending:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["records_per_second"] = stats["records"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Decodes archived eID files to NDJSON - an interrupted run is resumed when started again with the same output")
+    parser.add_argument("source", help = "directory, zip archive or tar archive with <id>.rn, <id>.address and <id>.jpg files")
+    parser.add_argument("output", help = "NDJSON file to write")
+    parser.add_argument("--processes", type = int, default = None, help = "worker processes, defaults to the amount of CPUs")
+    parser.add_argument("--batch-size", type = int, default = 500, help = "records per batch sent to a worker")
+    parser.add_argument("--no-photos", action = "store_true", help = "leave the photo out of the output")
+    arguments = parser.parse_args()
+
+    stats = decode_archive(arguments.source, arguments.output, arguments.processes, arguments.batch_size, not arguments.no_photos,
+        progress = lambda stats: print(f"\r{stats['records']} records - {stats['records_per_second']:.0f} records/s - {stats['errors']} errors", end = "", file = sys.stderr))
+    print(file = sys.stderr)
+    print(json.dumps(stats, indent = 4))
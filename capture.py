@@ -0,0 +1,297 @@
+from connection import eIDCardRemovedError, eIDReaderGoneError, eIDTransientError
+from transport import eIDTransport
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Capture file format - append only, so a crash never breaks the records that were written before
+#
+#   magic (8 bytes) followed by records
+#   record = length (uint32, little endian) + kind (uint8) + payload (length bytes)
+#
+# A record that was cut off (the length runs past the end of the file) is ignored when reading
+MAGIC = b"EIDCAP1\0"
+
+# Kinds of records
+## A session starts on every connect - started (float64, unix time) + card reader name (utf-8)
+SESSION = 1
+## An APDU exchange - elapsed since session start (uint64, us), duration (uint32, us), command length (uint16), sw1, sw2 + command + response
+APDU = 2
+## The card number of the session - found in the "Registre national" file (ascii)
+CARD = 3
+## A transmit that raised - elapsed (uint64, us), duration (uint32, us), command length (uint16) + command + error class name and message (utf-8, separated by a null byte)
+ERROR = 4
+
+_HEADER = struct.Struct("<IB")
+_SESSION = struct.Struct("<d")
+_APDU = struct.Struct("<QIHBB")
+_ERROR = struct.Struct("<QIH")
+
+# Errors a replayed transmit can raise - other errors are raised as Exception
+_ERRORS = {error.__name__: error for error in (eIDCardRemovedError, eIDReaderGoneError, eIDTransientError)}
+
+# Appends records to a capture file - one writer can be shared by the recorders of several card readers
+class eIDCaptureWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    # Methods
+
+    ## Appends a record - the record is flushed at once, so it survives a crash of the process
+    def write(self, kind, *parts):
+        payload = b"".join(parts)
+        with self._lock:
+            self._file.write(_HEADER.pack(len(payload), kind) + payload)
+            self._file.flush()
+
+    ## Closes the capture file
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+# Transport that records every APDU exchange of another transport to a capture file - see eIDReader.record
+class eIDRecorder(eIDTransport):
+
+    # Construct - writer is a path or an eIDCaptureWriter
+    def __init__(self, transport, writer):
+        self.transport = transport
+        self.writer = writer if isinstance(writer, eIDCaptureWriter) else eIDCaptureWriter(writer)
+        self._started = None
+        self._card_number = None
+        self._selected_rn = False
+
+    # Name of the recorded card reader
+    @property
+    def name(self):
+        return self.transport.name
+
+    def connect(self, refresh = False):
+        self.transport.connect(refresh)
+        self._start()
+
+    def reconnect(self):
+        self.transport.reconnect()
+        self._start()
+
+    def disconnect(self):
+        self.transport.disconnect()
+
+    def protocol(self):
+        return self.transport.protocol()
+
+    def transmit(self, apdu):
+        if self._started == None:
+            self._start()
+        command = bytes(apdu)
+        start = time.perf_counter()
+        try:
+            response, sw1, sw2 = self.transport.transmit(apdu)
+        except Exception as e:
+            end = time.perf_counter()
+            error = f"{type(e).__name__}\0{e}".encode("utf-8")
+            self.writer.write(ERROR, _ERROR.pack(self._microseconds(start), self._duration(start, end), len(command)), command, error)
+            raise
+        end = time.perf_counter()
+        self.writer.write(APDU, _APDU.pack(self._microseconds(start), self._duration(start, end), len(command), sw1, sw2), command, bytes(response))
+        self._find_card_number(command, response, sw1, sw2)
+        return response, sw1, sw2
+
+    # Starts a new session in the capture file
+    def _start(self):
+        self._started = time.perf_counter()
+        self._card_number = None
+        self._selected_rn = False
+        self.writer.write(SESSION, _SESSION.pack(time.time()), self.name.encode("utf-8"))
+
+    # Microseconds since the start of the session
+    def _microseconds(self, moment):
+        return max(0, int((moment - self._started) * 1000000))
+
+    # Duration in microseconds - limited to uint32
+    def _duration(self, start, end):
+        return min(0xFFFFFFFF, int((end - start) * 1000000))
+
+    # Records the card number once per session - it is the first TLV (tag 1) of the "Registre national" file (DF01/4031)
+    def _find_card_number(self, command, response, sw1, sw2):
+        if self._card_number != None or sw1 != 0x90 or sw2 != 0x00:
+            return
+        if command[1] == 0xA4:
+            self._selected_rn = command[-2:] == b"\x40\x31"
+        elif command[1] == 0xB0 and self._selected_rn and command[2:4] == b"\x00\x00" and len(response) >= 2 and response[0] == 1 and len(response) >= 2 + response[1]:
+            self._card_number = bytes(response[2:2 + response[1]]).decode("ascii", "replace")
+            self.writer.write(CARD, self._card_number.encode("ascii", "replace"))
+
+# A recorded session - the exchanges are read from the capture file when needed
+class eIDCaptureSession:
+
+    def __init__(self, capture, offset, started, reader):
+        self._capture = capture
+        self.offset = offset
+        self.started = started
+        self.reader = reader
+        self.card_numbers = []
+        self._records = []
+
+    # Methods
+
+    ## Returns the exchanges of the session as dictionaries - response is a memoryview of the capture file, error is None or (class name, message)
+    def exchanges(self):
+        exchanges = []
+        for kind, start, end in self._records:
+            data = self._capture._data
+            if kind == APDU:
+                elapsed, duration, command_length, sw1, sw2 = _APDU.unpack_from(data, start)
+                command_end = start + _APDU.size + command_length
+                exchanges.append({ "elapsed": elapsed / 1000000, "duration": duration / 1000000, "command": bytes(data[start + _APDU.size:command_end]),
+                    "response": memoryview(data)[command_end:end], "sw1": sw1, "sw2": sw2, "error": None })
+            else:
+                elapsed, duration, command_length = _ERROR.unpack_from(data, start)
+                command_end = start + _ERROR.size + command_length
+                name, _, message = bytes(data[command_end:end]).decode("utf-8").partition("\0")
+                exchanges.append({ "elapsed": elapsed / 1000000, "duration": duration / 1000000, "command": bytes(data[start + _ERROR.size:command_end]),
+                    "response": None, "sw1": None, "sw2": None, "error": (name, message) })
+        return exchanges
+
+    ## Amount of APDU exchanges in the session
+    def __len__(self):
+        return len(self._records)
+
+# Reads a capture file - the file is mapped in memory, only the record headers are read to build the index
+class eIDCapture:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self._data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) if size > 0 else b""
+        if self._data[:len(MAGIC)] != MAGIC:
+            raise Exception(f"Could not read '{path}' - not a capture file")
+
+        # Sessions in order and by card number
+        self.sessions = []
+        self.index = {}
+        self._build_index()
+
+    # Methods
+
+    ## Returns the sessions of a card number
+    def find(self, card_number):
+        return self.index.get(card_number, [])
+
+    ## Closes the capture file
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Walks over the record headers - exchanges before the first session are ignored, a record that was cut off ends the file
+    def _build_index(self):
+        data = self._data
+        size = len(data)
+        pointer = len(MAGIC)
+        session = None
+        while pointer + _HEADER.size <= size:
+            length, kind = _HEADER.unpack_from(data, pointer)
+            start = pointer + _HEADER.size
+            pointer = start + length
+            if pointer > size:
+                break
+            if kind == SESSION:
+                started, = _SESSION.unpack_from(data, start)
+                session = eIDCaptureSession(self, start, started, bytes(data[start + _SESSION.size:pointer]).decode("utf-8"))
+                self.sessions.append(session)
+            elif session == None:
+                continue
+            elif kind in (APDU, ERROR):
+                session._records.append((kind, start, pointer))
+            elif kind == CARD:
+                card_number = bytes(data[start:pointer]).decode("ascii")
+                session.card_numbers.append(card_number)
+                self.index.setdefault(card_number, []).append(session)
+
+# Transport that replays recorded sessions to eIDReader - every connect (after the first one) continues with the next recorded session, like when it was recorded
+# speed 1.0 replays at the recorded speed, 10.0 ten times faster and None as fast as possible
+class ReplayTransport(eIDTransport):
+
+    # Construct - capture is an eIDCapture or a path, session is the eIDCaptureSession to start with (defaults to the first session of card_number or the first session)
+    def __init__(self, capture, session = None, card_number = None, speed = None, check_commands = True):
+        self.capture = capture if isinstance(capture, eIDCapture) else eIDCapture(capture)
+        if session == None:
+            sessions = self.capture.find(card_number) if card_number else self.capture.sessions
+            if not sessions:
+                raise Exception(f"Replay failed - no recorded session found{' for card number ' + card_number if card_number else ''}")
+            session = sessions[0]
+        self._session_index = self.capture.sessions.index(session) - 1
+        self._speed = speed
+        self._check_commands = check_commands
+        self._exchanges = []
+        self._pointer = 0
+        self._started = None
+
+        # Statistics
+        self.apdu_count = 0
+
+    # Name of the recorded card reader
+    @property
+    def name(self):
+        return self.session.reader if self._session_index >= 0 else ""
+
+    # Current replayed session
+    @property
+    def session(self):
+        return self.capture.sessions[max(0, self._session_index)]
+
+    def connect(self, refresh = False):
+        self._next_session()
+
+    def reconnect(self):
+        self._next_session()
+
+    def disconnect(self):
+        pass
+
+    # The recorded protocol is not kept - a session with extended length READ BINARY commands was recorded with T=1
+    def protocol(self):
+        return "T1" if any(exchange["command"][1:2] == b"\xb0" and len(exchange["command"]) == 7 for exchange in self._exchanges) else None
+
+    def transmit(self, apdu):
+        if self._pointer >= len(self._exchanges):
+            raise Exception("Replay failed - no more recorded exchanges in the session")
+        exchange = self._exchanges[self._pointer]
+        self._pointer += 1
+        if self._check_commands and bytes(apdu) != exchange["command"]:
+            raise Exception(f"Replay failed - command differs from the recording. Expected '{exchange['command'].hex()}', sent '{bytes(apdu).hex()}'")
+
+        # Wait until the response was received in the recording
+        if self._speed:
+            wait = self._started + (exchange["elapsed"] + exchange["duration"]) / self._speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        self.apdu_count += 1
+        if exchange["error"]:
+            name, message = exchange["error"]
+            raise _ERRORS.get(name, Exception)(message)
+        return list(exchange["response"]), exchange["sw1"], exchange["sw2"]
+
+    # Continues with the next recorded session
+    def _next_session(self):
+        self._session_index += 1
+        if self._session_index >= len(self.capture.sessions):
+            raise eIDCardRemovedError("Replay failed - no more recorded sessions")
+        self._exchanges = self.capture.sessions[self._session_index].exchanges()
+        self._pointer = 0
+        self._started = time.perf_counter()
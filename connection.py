@@ -0,0 +1,115 @@
+import threading
+import time
+
+# Errors raised by a transport - the reader recovers from each of them in its own way
+
+## The card was removed (or no card is inserted) - recovered by connecting to the card again
+class eIDCardRemovedError(Exception):
+    pass
+
+## The card reader was unplugged (or the PC/SC service is gone) - recovered by looking for card readers again
+class eIDReaderGoneError(Exception):
+    pass
+
+## Sending a command failed, but the card and card reader are still there - recovered by sending the command again
+class eIDTransientError(Exception):
+    pass
+
+# Names of the PC/SC result codes by the error they mean - the codes are looked up in pyscard the first time an error is converted
+_CARD_REMOVED_NAMES = ("SCARD_W_REMOVED_CARD", "SCARD_W_RESET_CARD", "SCARD_E_NO_SMARTCARD", "SCARD_W_UNPOWERED_CARD", "SCARD_W_UNRESPONSIVE_CARD")
+_READER_GONE_NAMES = ("SCARD_E_READER_UNAVAILABLE", "SCARD_E_UNKNOWN_READER", "SCARD_E_NO_READERS_AVAILABLE", "SCARD_E_NO_SERVICE", "SCARD_E_SERVICE_STOPPED")
+_codes = None
+
+# Returns the PC/SC result codes (card removed, card reader gone) - pyscard is only imported when needed, so importing this module stays fast
+def _result_codes():
+    global _codes
+    if _codes == None:
+        from smartcard import scard
+        _codes = ({getattr(scard, name) for name in _CARD_REMOVED_NAMES if hasattr(scard, name)},
+            {getattr(scard, name) for name in _READER_GONE_NAMES if hasattr(scard, name)})
+    return _codes
+
+# Converts an exception of pyscard to one of the errors above - errors that are already converted are returned as is
+def classify_error(error):
+    if isinstance(error, (eIDCardRemovedError, eIDReaderGoneError, eIDTransientError)):
+        return error
+    from smartcard.Exceptions import NoCardException
+    if isinstance(error, NoCardException):
+        return eIDCardRemovedError(f"No card is inserted - {error}")
+
+    # pyscard keeps the PC/SC result code in hresult - older versions only have it in the message
+    code = getattr(error, "hresult", None)
+    card_removed_codes, reader_gone_codes = _result_codes()
+    message = str(error).lower()
+    # A card that was reset (e.g. by another process) needs a new connection, like a removed card
+    if code in card_removed_codes or "removed" in message or "no smart card" in message or "was reset" in message:
+        return eIDCardRemovedError(f"The card was removed or reset - {error}")
+    if code in reader_gone_codes or "reader is unavailable" in message or "unknown reader" in message:
+        return eIDReaderGoneError(f"The card reader is gone - {error}")
+    return eIDTransientError(f"Transmit failed - {error}")
+
+# Retry policy - the wait between tries grows exponentially, a transient error is retried right away the first time
+class eIDBackoff:
+
+    # Construct - tries is the total amount of tries (at least 1), delay is the first wait in seconds
+    def __init__(self, tries = 3, delay = 0.05, factor = 2.0, max_delay = 1.0):
+        if tries < 1:
+            raise ValueError(f"Invalid tries found: {tries}. Tries should be at least 1.")
+        self.tries = tries
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+
+    # Returns the wait in seconds before try number attempt (1 is the first retry) after error
+    def wait(self, attempt, error):
+        if isinstance(error, eIDTransientError):
+            attempt -= 1
+            if attempt <= 0:
+                return 0.0
+        return min(self.max_delay, self.delay * self.factor ** (attempt - 1))
+
+# Cached list of card readers - readers() is only called again when the list is older than max_age or refreshed
+class eIDReaderCache:
+
+    def __init__(self, max_age = 5.0):
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._readers = None
+        self._updated = 0.0
+
+    # Returns the card readers - pass refresh to look for card readers again
+    def get(self, refresh = False):
+        with self._lock:
+            if refresh or self._readers == None or time.monotonic() - self._updated > self._max_age:
+                from smartcard.System import readers
+                self._readers = list(readers())
+                self._updated = time.monotonic()
+            return self._readers
+
+# Card readers of this process - shared by all transports
+reader_cache = eIDReaderCache()
+
+# Capabilities of card readers by name - the protocol and the maximum response size are probed once per card reader
+class eIDCapabilityCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._capabilities = {}
+
+    # Returns the capabilities of a card reader as a dictionary (protocol, max_read_length) - returns None if not probed yet
+    def get(self, name):
+        with self._lock:
+            return self._capabilities.get(name)
+
+    # Sets the capabilities of a card reader
+    def set(self, name, protocol, max_read_length):
+        with self._lock:
+            self._capabilities[name] = { "protocol": protocol, "max_read_length": max_read_length }
+
+    # Forgets the capabilities of every card reader - they are probed again on the next read
+    def clear(self):
+        with self._lock:
+            self._capabilities.clear()
+
+# Capabilities of the card readers of this process - shared by all readers
+reader_capabilities = eIDCapabilityCache()
@@ -5,91 +5,125 @@ import time
 
 class eIDContact:
 
-    # Registre national (RN) data
-    card_number = ""
-    chip_number = ""
-    card_validity_begin = ""
-    card_validity_end = ""
-    card_delivery_municipality = ""
-    national_number = ""
-    name = ""
-    two_first_given_names = ""
-    first_letter_of_third_name = ""
-    nationality = ""
-    birthplace = ""
-    birthdate = ""
-    sex = ""
-    noble_condition = ""
-    document_type = ""
-    white_cane = 0
-    yellow_cane = 0
-    extended_minority = 0
-    hash_photo = ""
-
-    # Address data
-    street = ""
-    zip_code = ""
-    municipality = ""
-    country = "België"
-
-    # Photo data
-    photo = ""
-
-    # Created and updated
-    _created = datetime.datetime.now().timestamp()
-    updated = datetime.datetime.now().timestamp()
+    # Fields of a contact - file the field is read from and default value
+    # Used by _save, _reset, to_dict and to_json, so a field only has to be added here
+    _FIELDS = (
+
+        # Registre national (RN) data
+        ("card_number", "RN", ""),
+        ("chip_number", "RN", ""),
+        ("card_validity_begin", "RN", ""),
+        ("card_validity_end", "RN", ""),
+        ("card_delivery_municipality", "RN", ""),
+        ("national_number", "RN", ""),
+        ("name", "RN", ""),
+        ("two_first_given_names", "RN", ""),
+        ("first_letter_of_third_name", "RN", ""),
+        ("nationality", "RN", ""),
+        ("birthplace", "RN", ""),
+        ("birthdate", "RN", ""),
+        ("sex", "RN", ""),
+        ("noble_condition", "RN", ""),
+        ("document_type", "RN", ""),
+        ("white_cane", "RN", 0),
+        ("yellow_cane", "RN", 0),
+        ("extended_minority", "RN", 0),
+        ("hash_photo", "RN", ""),
+
+        # Address data
+        ("street", "ADDRESS", ""),
+        ("zip_code", "ADDRESS", ""),
+        ("municipality", "ADDRESS", ""),
+        ("country", None, "België"),
+
+        # Photo data - photo_verified is true when the photo matches the "hash photo" of the card
+        ("photo", "PHOTO", ""),
+        ("photo_verified", "PHOTO", False),
+    )
+
+    # Public field names in order - these are returned by to_dict and to_json
+    _FIELD_NAMES = tuple(field[0] for field in _FIELDS) + ("updated",)
+
+    # Photo data is kept in memory as bytes, or in _photo_file when the contact store wrote it to disk
+    # The base64 version of the photo is only created when needed (to_dict, to_json) and kept in _photo_base64
+    __slots__ = tuple(field[0] for field in _FIELDS if field[0] != "photo") + ("_photo", "_photo_base64", "_photo_file", "_created", "updated")
 
     # Construct
     def __init__(self, card_number):
+        for attribute_name, _, default in self._FIELDS:
+            setattr(self, attribute_name, default)
         self.card_number = card_number
+
+        # Created and updated
+        self._created = datetime.datetime.now().timestamp()
+        self.updated = self._created
     
+    # Properties
+
+    ## Photo as base64 - created from the photo bytes the first time it is used
+    @property
+    def photo(self):
+        if self._photo_file:
+            return base64.b64encode(self.photo_bytes).decode("ascii")
+        if self._photo_base64 == None:
+            self._photo_base64 = base64.b64encode(self._photo).decode("ascii")
+        return self._photo_base64
+
+    ## Sets the photo - takes the photo as bytes (JPG) or as base64, the photo is not verified until photo_verified is set
+    @photo.setter
+    def photo(self, value):
+        self.photo_verified = False
+        if isinstance(value, str):
+            self._photo = base64.b64decode(value)
+            self._photo_base64 = value or None
+        else:
+            self._photo = value if isinstance(value, bytes) else bytes(value)
+            self._photo_base64 = None
+        self._photo_file = None
+
+    ## Photo as bytes (JPG) - read from disk if the contact store wrote it to disk
+    @property
+    def photo_bytes(self):
+        if self._photo_file:
+            with open(self._photo_file, "rb") as file:
+                return file.read()
+        return self._photo
+
+    ## Photo as memoryview - the photo bytes are not copied
+    @property
+    def photo_view(self):
+        return memoryview(self.photo_bytes)
+
     # Methods
 
     ## Saves the current contact - we use a dictonary to save everything
     def _save(self, data):
 
-        # Loop over all values and set using setattr
+        # Loop over all values - the attribute and converter of every key are looked up in the save table
         for key, value in data.items():
+            field = self._SAVE_TABLE.get(key)
+            if not field:
+                raise Exception(f"Attribute '{key.replace(' ', '_')}' does not exist!")
 
-            # Convert spaces in keys to underscores to match the class attribute names
-            attribute_name = key.replace(" ", "_")
-
-            # Check if key is birthdate
-            if attribute_name == "birthdate":
-                value = self._birthdate_to_timestamp(value)
-
-            # Check if key is date like
-            if attribute_name == "card_validity_begin" or attribute_name == "card_validity_end":
-                value = self._date_to_timestamp(value)
-
-            # Check for SEX (why do they store the F versions in 3 languages????)
-            if attribute_name == "sex":
-                value = "M" if value == "M" else "F"
-
-            # Check for document_type
-            if attribute_name == "document_type":
-                value = self._document_type_to_string(value)
-
-            # Check for status code
-            if attribute_name == "special_status":
-                value = int(value)
-                self.white_cane = (value & 1) != 0
-                self.extended_minority = (value & 2) != 0
-                self.yellow_cane = (value & 4) != 0
-            else:
-                # Check if the attribute exists in the class before setting it
-                if hasattr(self, attribute_name):
-
-                    # Check if type is bytearray
-                    if isinstance(value, (bytes, bytearray)):
-                        # Encode and decode to convert bytes to string for JSON serialization
-                        value = base64.encodebytes(value).decode('utf-8').strip()
-                    setattr(self, attribute_name, value)
-                else:
-                    raise Exception(f"Attribute '{attribute_name}' does not exist!")
+            attribute_name, converter = field
+            if converter:
+                value = converter(self, value)
+            if attribute_name:
+                setattr(self, attribute_name, value)
 
         self.updated = datetime.datetime.now().timestamp()
 
+    ## Sex convert to "M" or "F" (why do they store the F versions in 3 languages????)
+    def _sex_to_string(self, sex):
+        return "M" if sex == "M" else "F"
+
+    ## Special status convert to white cane, extended minority and yellow cane
+    def _save_special_status(self, special_status):
+        special_status = int(special_status)
+        self.white_cane = (special_status & 1) != 0
+        self.extended_minority = (special_status & 2) != 0
+        self.yellow_cane = (special_status & 4) != 0
+
     ## Date convert to timestamp
     def _date_to_timestamp(self, date_str):
 
@@ -145,57 +179,38 @@ class eIDContact:
         return timestamp
         
 
-    ## Resets the current contact
+    ## Resets the current contact - files is a list of files (RN|ADDRESS|PHOTO) to reset, leave None to reset everything
     def _reset(self, files = None):
+        if files != None:
+            files = {"RN" if file.upper() == "RV" else file.upper() for file in files}
 
-        # Check if "RV" in files or None
-        if "RV" in files or files == None:
-
-            # Reset data for "RV"
-            self.card_number = ""
-            self.chip_number = ""
-            self.card_validity_begin = ""
-            self.card_validity_end = ""
-            self.card_delivery_municipality = ""
-            self.national_number = ""
-            self.name = ""
-            self.two_first_given_names = ""
-            self.first_letter_of_third_name = ""
-            self.nationality = ""
-            self.birthplace = ""
-            self.birthdate = ""
-            self.sex = ""
-            self.noble_condition = ""
-            self.document_type = ""
-            self.hash_photo = ""
-            self.white_cane = 0
-            self.yellow_cane = 0
-            self.extended_minority = 0
-    
-        # Check if "ADDRESS" in files or None
-        if "ADDRESS" in files or files == None:
-
-            # Reset data for "ADDRESS"
-            self.street = ""
-            self.zip_code = ""
-            self.municipality = ""
-
-        # Check if "PHOTO" in files or None
-        if "PHOTO" in files or files == None:
-
-            # Reset data for "PHOTO"
-            self.photo = ""
+        # Reset every field of the given files to its default value
+        for attribute_name, file, default in self._FIELDS:
+            if file and (files == None or file in files):
+                setattr(self, attribute_name, default)
 
     # Returns the current object as a JSON object
     def to_json(self):
         return json.dumps(
             self.to_dict(),
-            default=lambda o: o.__dict__, 
             sort_keys=True,
             ensure_ascii=False,
             indent=4)
     
     # Returns the current object as a DICT object
     def to_dict(self):
-        #return { "name": self.two_first_given_names, "updated": datetime.datetime.fromtimestamp(self.updated).strftime('%d/%m/%Y %H:%M:%S') }
-        return {key: getattr(self, key) for key in dir(self) if not key.startswith('_') and not callable(getattr(self, key))}
+        return {key: getattr(self, key) for key in self._FIELD_NAMES}
+
+    # Save table by data key - attribute to set and converter to apply, built once from the fields
+    _SAVE_TABLE = {field[0]: (field[0], None) for field in _FIELDS}
+    _SAVE_TABLE.update({
+        "birthdate": ("birthdate", _birthdate_to_timestamp),
+        "card_validity_begin": ("card_validity_begin", _date_to_timestamp),
+        "card_validity_end": ("card_validity_end", _date_to_timestamp),
+        "sex": ("sex", _sex_to_string),
+        "document_type": ("document_type", _document_type_to_string),
+        "special_status": (None, _save_special_status),
+    })
+
+    # Keys are accepted with spaces (as in the mappings of the reader) and with underscores
+    _SAVE_TABLE.update({key.replace("_", " "): field for key, field in _SAVE_TABLE.items()})
@@ -0,0 +1,310 @@
+from smartcard.CardMonitoring import CardMonitor, CardObserver
+from pool import eIDReaderPool
+from store import eIDContactStore
+from collections import deque
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+
+# Local daemon that owns the card readers - other processes read cards through it instead of connecting to PC/SC themselves
+#
+# Protocol - one JSON object per line in both directions, every request may have an "id" that is returned in the response
+#   { "op": "read", "reader": "...", "files": ["RN", "ADDRESS", "PHOTO"] } -> { "reader": "...", "contact": { ... } }
+#   { "op": "latest", "reader": "..." }                                    -> { "reader": "...", "contact": { ... } or null }
+#   { "op": "readers" }                                                    -> { "readers": [ ... ] }
+#   { "op": "stats" }                                                      -> { "stats": { ... } }
+#   { "op": "subscribe" }                                                  -> { "subscribed": true }, then events:
+#       { "event": "contact", "reader": "...", "contact": { ... } } when a card was read
+#       { "event": "removed", "reader": "..." } when a card was removed
+# An error is returned as { "error": "..." }
+class eIDDaemon:
+
+    # Construct - address is the path of the Unix socket, or a (host, port) tuple for a local TCP socket
+    # name is used to only open card readers that start with name, files are read when a card is inserted (read_on_insert)
+    # The daemon runs for a long time, so the pool keeps at most max_contacts contacts - the latest read per card reader is kept apart from that
+    def __init__(self, address = "/tmp/eid.sock", name = "", files = None, read_on_insert = True, pool = None, max_contacts = 100):
+        self.address = address
+        self._name = name
+        self._files = files
+        self._read_on_insert = read_on_insert
+        self._pool = pool if pool != None else eIDReaderPool(name, eIDContactStore(max_contacts = max_contacts))
+        self._loop = None
+        self._server = None
+        self._monitor = None
+        self._observer = None
+
+        # Reads that are running by (reader name, generation, files) - requests for the same card wait for a read of at least their files
+        self._reads = {}
+
+        # Latest read per reader name - (generation, files, contact), only used while the card was not removed
+        self._latest = {}
+        self._generations = {}
+
+        # Writers of subscribed clients
+        self._subscribers = set()
+
+        # Statistics
+        self._stats = { "requests": 0, "physical_reads": 0, "coalesced": 0, "cached": 0, "errors": 0, "clients": 0 }
+        self._latencies = deque(maxlen = 1000)
+        self._waiting = 0
+
+    # Methods
+
+    ## Starts the daemon - the card monitor is started as well, so inserted cards are read and pushed to subscribers
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if isinstance(self.address, tuple):
+            self._server = await asyncio.start_server(self._handle_client, *self.address)
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = await asyncio.start_unix_server(self._handle_client, self.address)
+        self._observer = _DaemonObserver(self)
+        self._monitor = CardMonitor()
+        self._monitor.addObserver(self._observer)
+
+    ## Runs the daemon until it is cancelled
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    ## Stops the daemon and closes all card readers
+    async def close(self):
+        if self._monitor:
+            self._monitor.deleteObserver(self._observer)
+            self._monitor = None
+        for writer in list(self._subscribers):
+            writer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.remove(self.address)
+        await self._loop.run_in_executor(None, self._pool.close)
+
+    ## Returns the statistics - queue depth is the amount of requests waiting for a read, latency is in seconds
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return dict(self._stats,
+            queue_depth = self._waiting,
+            running_reads = len(self._reads),
+            subscribers = len(self._subscribers),
+            latency = {
+                "count": len(latencies),
+                "average": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                "p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+                "max": latencies[-1] if latencies else 0.0,
+            },
+            readers = self._pool.stats())
+
+    ## Reads the card in a card reader - returns the eIDContact
+    ## A request for a card that is being read waits for that read, a card that was read since it was inserted is not read again
+    async def read(self, reader_name = None, files = None):
+        reader_name = await self._reader_name(reader_name)
+        files = tuple(sorted(file.upper() for file in (files or self._files or ("RN", "ADDRESS", "PHOTO"))))
+
+        # Card was read since it was inserted - files that were read are kept
+        generation = self._generations.get(reader_name, 0)
+        latest = self._latest.get(reader_name)
+        if latest and latest[0] == generation and set(files) <= set(latest[1]):
+            self._stats["cached"] += 1
+            return latest[2]
+
+        # Read of the same card with at least these files is running - wait for it
+        future = next((running for (name, running_generation, running_files), running in self._reads.items()
+            if name == reader_name and running_generation == generation and set(files) <= set(running_files)), None)
+        if future:
+            self._stats["coalesced"] += 1
+        else:
+            future = self._reads[(reader_name, generation, files)] = self._loop.create_task(self._physical_read(reader_name, generation, files))
+        self._waiting += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiting -= 1
+
+    # Reads the card on the worker of the card reader (see eIDReaderPool) - pushes the contact to subscribers
+    async def _physical_read(self, reader_name, generation, files):
+        self._stats["physical_reads"] += 1
+        try:
+            contact = await asyncio.wrap_future(self._pool.submit(reader_name, list(files)))
+        finally:
+            self._reads.pop((reader_name, generation, files), None)
+
+        # Card may have been removed while it was read - then the contact is not kept as latest
+        # The contact of a card is updated by every read, so the files read before for this card are kept as well
+        if generation == self._generations.get(reader_name, 0):
+            latest = self._latest.get(reader_name)
+            if latest and latest[0] == generation:
+                files = tuple(sorted(set(files) | set(latest[1])))
+            self._latest[reader_name] = (generation, files, contact)
+        self._publish({ "event": "contact", "reader": reader_name, "contact": contact.to_dict() })
+        return contact
+
+    # Returns the card reader to read - the first card reader when no name is given
+    async def _reader_name(self, reader_name):
+        names = self._pool.reader_names()
+        if not names or (reader_name and reader_name not in names):
+            await self._loop.run_in_executor(None, self._pool.refresh)
+            names = self._pool.reader_names()
+        if not reader_name:
+            if not names:
+                raise Exception("Could not find card reader.")
+            return names[0]
+        if reader_name not in names:
+            raise Exception(f"Could not find card reader '{reader_name}'.")
+        return reader_name
+
+    # Called on the event loop when a card was inserted or removed - the connection to a removed card is dropped, so the next card is read without a reset
+    def _card_changed(self, reader_name, inserted):
+        if not reader_name.lower().startswith(self._name.lower()):
+            return
+        self._generations[reader_name] = self._generations.get(reader_name, 0) + 1
+        self._latest.pop(reader_name, None)
+        if inserted and self._read_on_insert:
+            task = self._loop.create_task(self.read(reader_name))
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        elif not inserted:
+            self._pool.disconnect(reader_name)
+            self._publish({ "event": "removed", "reader": reader_name })
+
+    # Sends an event to every subscriber
+    def _publish(self, event):
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        for writer in list(self._subscribers):
+            if writer.is_closing():
+                self._subscribers.discard(writer)
+            else:
+                writer.write(line)
+
+    # Handles the requests of a client - requests of one client are handled one after the other
+    async def _handle_client(self, reader, writer):
+        self._stats["clients"] += 1
+        try:
+            while line := await reader.readline():
+                response = await self._handle_request(line, writer)
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            self._stats["clients"] -= 1
+            writer.close()
+
+    # Handles one request - returns the response
+    async def _handle_request(self, line, writer):
+        start = time.perf_counter()
+        self._stats["requests"] += 1
+        request = {}
+        try:
+            request = json.loads(line)
+            match request.get("op"):
+                case "read":
+                    reader_name = await self._reader_name(request.get("reader"))
+                    contact = await self.read(reader_name, request.get("files"))
+                    response = { "reader": reader_name, "contact": contact.to_dict() }
+                case "latest":
+                    reader_name = await self._reader_name(request.get("reader"))
+                    latest = self._latest.get(reader_name)
+                    response = { "reader": reader_name, "contact": latest[2].to_dict() if latest else None }
+                case "readers":
+                    await self._loop.run_in_executor(None, self._pool.refresh)
+                    response = { "readers": self._pool.reader_names() }
+                case "stats":
+                    response = { "stats": self.stats() }
+                case "subscribe":
+                    self._subscribers.add(writer)
+                    response = { "subscribed": True }
+                case _:
+                    raise Exception(f"Unknown op '{request.get('op')}'. Allowed ops are read|latest|readers|stats|subscribe")
+        except Exception as e:
+            self._stats["errors"] += 1
+            response = { "error": str(e) }
+        self._latencies.append(time.perf_counter() - start)
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        return response
+
+## Passes inserted and removed cards from the card monitor thread to the event loop of the daemon
+class _DaemonObserver(CardObserver):
+
+    def __init__(self, daemon):
+        self._daemon = daemon
+
+    def update(self, observable, actions):
+        added_cards, removed_cards = actions
+        for card in removed_cards:
+            self._daemon._loop.call_soon_threadsafe(self._daemon._card_changed, str(card.reader), False)
+        for card in added_cards:
+            self._daemon._loop.call_soon_threadsafe(self._daemon._card_changed, str(card.reader), True)
+
+# Blocking client of the daemon - use one client per thread
+class eIDDaemonClient:
+
+    # Construct - address is the path of the Unix socket, or a (host, port) tuple
+    def __init__(self, address = "/tmp/eid.sock", timeout = None):
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rwb")
+        self._id = 0
+
+    # Methods
+
+    ## Sends a request and returns the response - raises exception when the daemon returns an error
+    def request(self, op, **arguments):
+        self._id += 1
+        self._file.write((json.dumps(dict(arguments, op = op, id = self._id)) + "\n").encode("utf-8"))
+        self._file.flush()
+        while True:
+            response = json.loads(self._file.readline())
+
+            # Events of a subscription may arrive before the response
+            if response.get("id") == self._id:
+                break
+        if "error" in response:
+            raise Exception(response["error"])
+        return response
+
+    ## Reads the card in a card reader - returns the contact as a dictionary
+    def read(self, reader = None, files = None):
+        return self.request("read", reader = reader, files = files)["contact"]
+
+    ## Returns the statistics of the daemon
+    def stats(self):
+        return self.request("stats")["stats"]
+
+    ## Subscribes to read and removed cards - yields every event, use as "for event in client.subscribe()"
+    def subscribe(self):
+        self.request("subscribe")
+        while line := self._file.readline():
+            yield json.loads(line)
+
+    ## Closes the connection to the daemon
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Daemon that owns the eID card readers and serves reads over a local socket")
+    parser.add_argument("--socket", default = "/tmp/eid.sock", help = "path of the Unix socket")
+    parser.add_argument("--port", type = int, default = None, help = "listen on 127.0.0.1 with this port instead of a Unix socket")
+    parser.add_argument("--name", default = "", help = "only open card readers that start with name")
+    parser.add_argument("--files", nargs = "*", default = None, help = "files read when a card is inserted (RN ADDRESS PHOTO)")
+    arguments = parser.parse_args()
+
+    address = ("127.0.0.1", arguments.port) if arguments.port else arguments.socket
+    try:
+        asyncio.run(eIDDaemon(address, arguments.name, arguments.files).serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+from contact import eIDContact
+from photo_cache import verify_photo
+
+# Mapping for "Address" file
+ADDRESS_MAPPING = {
+    1: { "name": "street", "encoding": "utf-8" },
+    2: { "name": "zip_code", "encoding": "ascii" }, 
+    3: { "name": "municipality", "encoding": "utf-8" },
+}
+
+# Mapping for "Registre national" file
+REGISTRE_NATIONAL_MAPPING = {
+    1: { "name": "card number", "encoding": "ascii" },
+    2: { "name": "chip number", "encoding": "" }, 
+    3: { "name": "card validity begin", "encoding": "ascii" },
+    4: { "name": "card validity end", "encoding": "ascii" },
+    5: { "name": "card delivery municipality", "encoding": "utf-8" },
+    6: { "name": "national number", "encoding": "ascii" },
+    7: { "name": "name", "encoding": "utf-8" },
+    8: { "name": "two first given names", "encoding": "utf-8" },
+    9: { "name": "first letter of third name", "encoding": "utf-8" },
+    10: { "name": "nationality", "encoding": "utf-8" },
+    11: { "name": "birthplace", "encoding": "utf-8" },
+    12: { "name": "birthdate", "encoding": "utf-8" },
+    13: { "name": "sex", "encoding": "ascii" },
+    14: { "name": "noble condition", "encoding": "utf-8" },
+    15: { "name": "document type", "encoding": "ascii" },
+    16: { "name": "special status", "encoding": "ascii" },
+    17: { "name": "hash photo", "encoding": "" },
+}
+
+class eIDDecoder:
+
+    # Construct - compiles a mapping ({ tag: { "name": ..., "encoding": ... } }) into a lookup table, empty encoding means hex
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self._fields = {tag: (field["name"], field["encoding"]) for tag, field in mapping.items()}
+        self._names = {field["name"] for field in mapping.values()}
+
+    # Methods
+
+    ## Decodes TLV data (tag, length, value) - returns a dictionary with the value by name
+    ## When selected_data is given, only those names are decoded and decoding stops as soon as all of them are found
+    ## Unknown tags (e.g. tags added by newer cards) are skipped
+    def decode(self, data, selected_data = None):
+
+        # A response of the card is a list of ints - convert once, bytes and bytearrays are used as is
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytearray(data)
+        size = len(data)
+        fields = self._fields
+
+        # Tags that still have to be found
+        if selected_data == None:
+            wanted = None
+            remaining = len(fields)
+        else:
+            wanted = {name for name in selected_data if name in self._names}
+            remaining = len(wanted)
+
+        response = {}
+        pointer = 0
+        while remaining > 0 and pointer + 2 <= size:
+            field = fields.get(data[pointer])
+            start = pointer + 2
+            pointer = start + data[pointer + 1]
+
+            # Stop at a value that runs past the end of the data
+            if pointer > size:
+                break
+
+            # Get value and encode following the mapped encoding - if no encoding use hex
+            if field and (wanted == None or field[0] in wanted):
+                name, encoding = field
+                if name not in response:
+                    remaining -= 1
+                response[name] = data[start:pointer].decode(encoding) if encoding else data[start:pointer].hex()
+
+        return response
+
+    ## Encodes a dictionary with the value by name as TLV data - the reverse of decode, used by the simulated card
+    def encode(self, values):
+        data = bytearray()
+        for tag, (name, encoding) in self._fields.items():
+            if name in values:
+                value = values[name].encode(encoding) if encoding else bytes.fromhex(values[name])
+                data += bytes([tag, len(value)]) + value
+        return bytes(data)
+
+# Compiled decoders by mapping - a mapping is compiled the first time it is used
+_decoders = {}
+
+# Returns the compiled decoder of a mapping
+def get_decoder(mapping):
+    decoder = _decoders.get(id(mapping))
+    if not decoder or decoder.mapping is not mapping:
+        decoder = _decoders[id(mapping)] = eIDDecoder(mapping)
+    return decoder
+
+# Decodes the raw bytes of the files of a card into an eIDContact - no card reader is needed, e.g. for files that were archived
+# address_bytes and photo_bytes may be None when the file was not kept - raises exception for invalid data
+def decode_files(rn_bytes, address_bytes = None, photo_bytes = None):
+    data = get_decoder(REGISTRE_NATIONAL_MAPPING).decode(rn_bytes)
+    if not data.get("card number"):
+        raise Exception("Decode failed - the \"Registre national\" file does not contain a card number")
+    contact = eIDContact(data["card number"])
+    contact._save(data)
+
+    if address_bytes != None:
+        contact._save(get_decoder(ADDRESS_MAPPING).decode(address_bytes))
+
+    # A JPG should start with a certain marker (FFD8) and end with a certain marker (FFD9)
+    if photo_bytes != None:
+        if photo_bytes[:2] != b"\xff\xd8" or photo_bytes[-2:] != b"\xff\xd9":
+            raise Exception("Decode failed - the photo is not a JPG")
+        contact._save({ "photo": bytes(photo_bytes), "photo_verified": bool(contact.hash_photo) and verify_photo(photo_bytes, contact.hash_photo) })
+
+    return contact
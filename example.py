@@ -1,26 +1,22 @@
-from reader import eIDReader
+from monitor import eIDMonitor
 
-# Method that keeps reading the card
-def read_card():
-    while eID.read_card():
+# Called every time a card is inserted and read
+def card_read(eID_contact):
 
-        # Data received
-        print("Read OK")
+    # Data received
+    print("Read OK")
 
-        # Print last read card content to screen
-        print(eID.get_last_read().to_json())
+    # Print read card content to screen
+    print(eID_contact.to_json())
 
-        # Wait for user input to read next card
-        input("Press Enter to read the next card...")
-
-# Create eID object using name of card reader - I am using the "Cherry ST-1144" card reader! Make sure to use a card reader that can use CCID using protocol T0, T1!
-eID = eIDReader("cherry")
-while True:
-    try:
-        read_card()
-    except Exception as e:
-        print("Error reading card: ")
-        print(e)
-        input("Press Enter to try again...")
-        pass
+# Called when reading an inserted card failed
+def card_error(reader_name, e):
+    print(f"Error reading card in '{reader_name}': ")
+    print(e)
 
+# Create eID monitor using name of card reader - I am using the "Cherry ST-1144" card reader! Make sure to use a card reader that can use CCID using protocol T0, T1!
+# The card is read the moment it is inserted - no need to press anything
+eID_monitor = eIDMonitor(card_read, "cherry", error_callback=card_error)
+eID_monitor.start()
+input("Insert a card to read it - press Enter to stop...\n")
+eID_monitor.stop()
@@ -0,0 +1,125 @@
+from contact import eIDContact
+import base64
+import csv
+import hashlib
+import json
+import os
+import time
+
+# Formats that can be exported by file extension
+FORMATS = {
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".csv": "csv",
+}
+
+# Columns of an export in order - the fields of eIDContact, so a field added there is exported as well
+COLUMNS = eIDContact._FIELD_NAMES
+
+# Streams contacts to an NDJSON or CSV file - one contact is converted and written at a time, so memory does not grow with the amount of contacts
+# Use as "with eIDExporter("contacts.csv") as exporter: exporter.write_all(reader.eID_contacts)"
+class eIDExporter:
+
+    # Construct - output is a path or an opened text file, format is "ndjson" or "csv" (defaults to the extension of output, otherwise "ndjson")
+    # When photo_dir is set, every photo is written to that directory as <sha256 of the photo>.jpg and the photo column holds the file name
+    # Otherwise the photo is exported as base64, pass photos false to leave the photo column out
+    # The output is flushed every flush_every contacts and when closing
+    def __init__(self, output, format = None, photo_dir = None, photos = True, flush_every = 100):
+        if format == None:
+            format = FORMATS.get(os.path.splitext(output)[1].lower(), "ndjson") if isinstance(output, str) else "ndjson"
+        if format not in FORMATS.values():
+            raise ValueError(f"Invalid format found: {format}. Allowed formats are: {', '.join(sorted(set(FORMATS.values())))}.")
+        self.format = format
+        self.columns = COLUMNS if photos or photo_dir else tuple(column for column in COLUMNS if column != "photo")
+        self._photo_dir = photo_dir
+        if photo_dir:
+            os.makedirs(photo_dir, exist_ok = True)
+        self._flush_every = flush_every
+
+        # A path is opened (and closed) by the exporter, an opened file is left open
+        self._owns_file = isinstance(output, str)
+        self._file = open(output, "w", encoding = "utf-8", newline = "") if self._owns_file else output
+        self._csv = None
+        if format == "csv":
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.columns)
+
+        # Statistics
+        self.stats = { "contacts": 0, "photos_written": 0, "photos_existing": 0, "seconds": 0.0 }
+        self._start = time.perf_counter()
+
+    # Methods
+
+    ## Writes one contact
+    def write(self, contact):
+        row = self._row(contact)
+        if self._csv:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii = False) + "\n")
+        self.stats["contacts"] += 1
+        if self._flush_every and self.stats["contacts"] % self._flush_every == 0:
+            self._file.flush()
+
+    ## Writes every contact of contacts (a list, an eIDContactStore or a generator) - returns the amount of written contacts
+    def write_all(self, contacts):
+        count = 0
+        for contact in contacts:
+            self.write(contact)
+            count += 1
+        return count
+
+    ## Flushes and closes the output - returns the statistics
+    def close(self):
+        if self._file:
+            self._file.flush()
+            if self._owns_file:
+                self._file.close()
+            self._file = None
+        self.stats["seconds"] = time.perf_counter() - self._start
+        return dict(self.stats)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Returns the values of a contact in column order - the base64 photo is not kept on the contact, so exporting does not add memory to a store
+    def _row(self, contact):
+        row = []
+        for column in self.columns:
+            if column != "photo":
+                row.append(getattr(contact, column))
+            elif self._photo_dir:
+                row.append(self._write_photo(contact.photo_bytes))
+            else:
+                row.append(contact._photo_base64 or base64.b64encode(contact.photo_bytes).decode("ascii"))
+        return row
+
+    # Writes a photo to the photo directory - returns the file name, a photo that was written before (same content) is not written again
+    def _write_photo(self, photo):
+        if not photo:
+            return ""
+        name = hashlib.sha256(photo).hexdigest() + ".jpg"
+        path = os.path.join(self._photo_dir, name)
+        if os.path.exists(path):
+            self.stats["photos_existing"] += 1
+            return name
+
+        # Written to a temporary file first - an interrupted export never leaves a partial photo under its final name
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(photo)
+        os.replace(temporary_path, path)
+        self.stats["photos_written"] += 1
+        return name
+
+## Exports contacts to output - see eIDExporter for the arguments, returns the statistics (contacts, photos_written, photos_existing, seconds)
+def export_contacts(contacts, output, format = None, photo_dir = None, photos = True):
+    exporter = eIDExporter(output, format, photo_dir, photos)
+    try:
+        exporter.write_all(contacts)
+    finally:
+        stats = exporter.close()
+    return stats
@@ -0,0 +1,193 @@
+import json
+import os
+import tempfile
+import threading
+
+# Event emitted by eIDReader to its hooks - for every APDU ("apdu") and for every phase of a read ("phase")
+class eIDEvent:
+
+    __slots__ = ("kind", "reader", "file", "phase", "command", "sw1", "sw2", "bytes_sent", "bytes_received", "seconds", "retry", "error")
+
+    # Construct - retry is the number of select retries that were needed before this event, error is set if an exception was raised
+    def __init__(self, kind, reader, file, phase = None, command = None, sw1 = None, sw2 = None, bytes_sent = 0, bytes_received = 0, seconds = 0.0, retry = 0, error = None):
+        self.kind = kind
+        self.reader = reader
+        self.file = file
+        self.phase = phase
+        self.command = command
+        self.sw1 = sw1
+        self.sw2 = sw2
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.seconds = seconds
+        self.retry = retry
+        self.error = error
+
+    # Status words as text (e.g. "9000") - None for phases
+    @property
+    def status(self):
+        if self.sw1 == None:
+            return None
+        return f"{self.sw1:02X}{self.sw2:02X}"
+
+    # Returns the event as a DICT object - the command is returned as hex
+    def to_dict(self):
+        data = {key: getattr(self, key) for key in self.__slots__}
+        data["command"] = bytes(self.command).hex() if self.command != None else None
+        data["status"] = self.status
+        del data["sw1"], data["sw2"]
+        return data
+
+# Hook that counts APDUs and bytes and keeps latency histograms per reader and file, and per reader and phase
+class eIDMetrics:
+
+    # Upper bounds in seconds of the latency histogram buckets
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._apdus = {}
+        self._phases = {}
+
+    # Called by eIDReader for every event
+    def __call__(self, event):
+        with self._lock:
+            if event.kind == "apdu":
+                counters = self._apdus.get((event.reader, event.file))
+                if not counters:
+                    counters = self._apdus[(event.reader, event.file)] = { "apdus": 0, "errors": 0, "retries": 0, "bytes_sent": 0, "bytes_received": 0, "sw1": {}, "latency": self._histogram() }
+                counters["apdus"] += 1
+                counters["errors"] += 1 if event.error else 0
+                if event.sw1 != None:
+                    sw1 = f"{event.sw1:02X}"
+                    counters["sw1"][sw1] = counters["sw1"].get(sw1, 0) + 1
+                counters["retries"] += 1 if event.retry else 0
+                counters["bytes_sent"] += event.bytes_sent
+                counters["bytes_received"] += event.bytes_received
+            else:
+                counters = self._phases.get((event.reader, event.phase))
+                if not counters:
+                    counters = self._phases[(event.reader, event.phase)] = { "count": 0, "errors": 0, "latency": self._histogram() }
+                counters["count"] += 1
+                counters["errors"] += 1 if event.error else 0
+            self._observe(counters["latency"], event.seconds)
+
+    # Methods
+
+    ## Returns all counters and histograms as a DICT object
+    def to_dict(self):
+        with self._lock:
+            return {
+                "apdus": [dict(self._copy(counters), reader = reader, file = file) for (reader, file), counters in self._apdus.items()],
+                "phases": [dict(self._copy(counters), reader = reader, phase = phase) for (reader, phase), counters in self._phases.items()]
+            }
+
+    ## Returns all counters and histograms in the Prometheus text format
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = []
+
+        # APDU counters
+        for name, key, description in (
+            ("eid_apdus_total", "apdus", "APDU commands sent to the card"),
+            ("eid_apdu_errors_total", "errors", "APDU commands that failed to transmit"),
+            ("eid_apdu_retries_total", "retries", "APDU commands sent while retrying a select"),
+            ("eid_bytes_sent_total", "bytes_sent", "Bytes sent to the card"),
+            ("eid_bytes_received_total", "bytes_received", "Bytes received from the card"),
+        ):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f"{name}{self._labels(reader = counters['reader'], file = counters['file'])} {counters[key]}" for counters in data["apdus"]]
+
+        # APDU responses by status word 1 (e.g. 90 for success, 6C for wrong length)
+        lines += ["# HELP eid_apdu_responses_total APDU responses by status word 1", "# TYPE eid_apdu_responses_total counter"]
+        for counters in data["apdus"]:
+            lines += [f"eid_apdu_responses_total{self._labels(reader = counters['reader'], file = counters['file'], sw1 = sw1)} {count}" for sw1, count in counters["sw1"].items()]
+
+        # Phase counters
+        lines += ["# HELP eid_phases_total Phases of a read", "# TYPE eid_phases_total counter"]
+        lines += [f"eid_phases_total{self._labels(reader = counters['reader'], phase = counters['phase'])} {counters['count']}" for counters in data["phases"]]
+        lines += ["# HELP eid_phase_errors_total Phases of a read that raised an exception", "# TYPE eid_phase_errors_total counter"]
+        lines += [f"eid_phase_errors_total{self._labels(reader = counters['reader'], phase = counters['phase'])} {counters['errors']}" for counters in data["phases"]]
+
+        # Latency histograms
+        lines += ["# HELP eid_apdu_seconds Time to send an APDU command and receive the response", "# TYPE eid_apdu_seconds histogram"]
+        for counters in data["apdus"]:
+            lines += self._histogram_lines("eid_apdu_seconds", counters["latency"], reader = counters["reader"], file = counters["file"])
+        lines += ["# HELP eid_phase_seconds Time spent in a phase of a read", "# TYPE eid_phase_seconds histogram"]
+        for counters in data["phases"]:
+            lines += self._histogram_lines("eid_phase_seconds", counters["latency"], reader = counters["reader"], phase = counters["phase"])
+
+        return "\n".join(lines) + "\n"
+
+    ## Writes the Prometheus text format to path - the file is replaced at once so a collector never reads half a file
+    def write_prometheus(self, path):
+        file_descriptor, temporary_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = ".tmp")
+        with os.fdopen(file_descriptor, "w", encoding = "utf-8") as file:
+            file.write(self.to_prometheus())
+        os.replace(temporary_path, path)
+
+    ## Returns all counters and histograms as JSON
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    # Creates an empty histogram
+    def _histogram(self):
+        return { "buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0 }
+
+    # Adds a value to a histogram
+    def _observe(self, histogram, value):
+        for index, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+    # Copies counters so they can be read without the lock
+    def _copy(self, counters):
+        counters = dict(counters)
+        if "sw1" in counters:
+            counters["sw1"] = dict(counters["sw1"])
+        counters["latency"] = { "buckets": list(counters["latency"]["buckets"]), "count": counters["latency"]["count"], "sum": counters["latency"]["sum"] }
+        return counters
+
+    # Creates the lines of a histogram in the Prometheus text format - buckets are cumulative
+    def _histogram_lines(self, name, histogram, **labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+            total += count
+            lines.append(f"{name}_bucket{self._labels(**labels, le = repr(bound))} {total}")
+        lines.append(f"{name}_bucket{self._labels(**labels, le = '+Inf')} {histogram['count']}")
+        lines.append(f"{name}_sum{self._labels(**labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{self._labels(**labels)} {histogram['count']}")
+        return lines
+
+    # Creates the labels of a metric in the Prometheus text format
+    def _labels(self, **labels):
+        return "{" + ",".join(f'{key}="{self._escape(value)}"' for key, value in labels.items()) + "}"
+
+    # Escapes a label value - backslash, double quote and new line have to be escaped
+    def _escape(self, value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Hook that writes every event as a JSON line to a file
+class eIDJsonLinesExporter:
+
+    # Construct - file is a path or a file like object
+    def __init__(self, file):
+        self._lock = threading.Lock()
+        self._owned = isinstance(file, (str, os.PathLike))
+        self._file = open(file, "a", encoding = "utf-8") if self._owned else file
+
+    # Called by eIDReader for every event
+    def __call__(self, event):
+        line = json.dumps(event.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    ## Closes the file if it was opened by this exporter
+    def close(self):
+        if self._owned:
+            self._file.close()
@@ -0,0 +1,105 @@
+from smartcard.CardMonitoring import CardMonitor, CardObserver
+from concurrent.futures import ThreadPoolExecutor
+from connection import reader_cache
+from reader import eIDReader
+from store import eIDContactStore
+import threading
+
+class eIDMonitor(CardObserver):
+
+    # Construct - callback is called with the read eIDContact every time a card is inserted, on the worker thread of the card reader
+    # name is used to only watch card readers that start with name, leave empty to watch every card reader
+    # Pass a store (eIDContactStore) to limit the amount of kept contacts - every card reader keeps its contacts in this store
+    def __init__(self, callback, name = "", files = None, selected_data = None, error_callback = None, store = None):
+        self._callback = callback
+        self._error_callback = error_callback
+        self._name = name
+        self._files = files
+        self._selected_data = selected_data
+        self.contacts = store if store != None else eIDContactStore()
+        self._monitor = None
+
+        # Lock of the readers and workers below - only held to look them up, never while a card is read
+        self._lock = threading.Lock()
+
+        # Readers by reader name - kept between insertions so the reader is only looked up once
+        self._readers = {}
+
+        # Worker per reader name - cards are read off the card monitor thread, cards in different card readers are read at the same time
+        # Insertions and removals of one card reader are handled in the order they happened
+        self._workers = {}
+
+    # Methods
+
+    ## Starts watching for inserted and removed cards - cards that are already inserted are read right away
+    def start(self):
+        if not self._monitor:
+            self._monitor = CardMonitor()
+            self._monitor.addObserver(self)
+
+    ## Stops watching for cards and drops all connections
+    def stop(self):
+        if self._monitor:
+            self._monitor.deleteObserver(self)
+            self._monitor = None
+        with self._lock:
+            workers, self._workers = self._workers, {}
+        for reader_name, worker in workers.items():
+            worker.submit(self._disconnect, reader_name)
+            worker.shutdown(wait = True)
+
+    ## Called by the card monitor when cards are inserted or removed - returns at once, the card readers are handled by their workers
+    def update(self, observable, actions):
+        added_cards, removed_cards = actions
+
+        # Drop the connection of removed cards - the next insertion connects again
+        for card in removed_cards:
+            worker = self._worker(str(card.reader), create = False)
+            if worker:
+                worker.submit(self._disconnect, str(card.reader))
+
+        # Read inserted cards
+        for card in added_cards:
+            if str(card.reader).lower().startswith(self._name.lower()):
+                self._worker(str(card.reader)).submit(self._read, str(card.reader))
+
+    # Returns the worker of a card reader - created on the first insertion, returns None if not created and create is false
+    def _worker(self, reader_name, create = True):
+        with self._lock:
+            worker = self._workers.get(reader_name)
+            if not worker and create:
+                worker = self._workers[reader_name] = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = f"eIDMonitor {reader_name}")
+            return worker
+
+    # Drops the connection of the card reader with reader_name - runs on the worker of that card reader
+    def _disconnect(self, reader_name):
+        with self._lock:
+            reader = self._readers.get(reader_name)
+        if reader:
+            reader._disconnect()
+
+    # Reads the card that was inserted in the card reader with reader_name - runs on the worker of that card reader
+    def _read(self, reader_name):
+        try:
+
+            # Connect to the card - on the first insertion the reader is bound, after that it only connects again
+            with self._lock:
+                reader = self._readers.get(reader_name)
+            if not reader:
+                bound_reader = next((found for found in reader_cache.get() if str(found) == reader_name), None) \
+                    or next((found for found in reader_cache.get(refresh = True) if str(found) == reader_name), None)
+                if not bound_reader:
+                    raise Exception(f"Could not find card reader '{reader_name}'.")
+                reader = eIDReader(reader = bound_reader, store = self.contacts)
+                with self._lock:
+                    self._readers[reader_name] = reader
+            else:
+                reader._reconnect()
+
+            contact = reader.session(self._files, self._selected_data).run()
+        except Exception as e:
+            if self._error_callback:
+                self._error_callback(reader_name, e)
+            return
+
+        self._callback(contact)
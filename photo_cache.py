@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+
+# Hash algorithm used for "hash photo" by the length of the hash - older applets use SHA-1, newer applets use SHA-256 or SHA-384
+_PHOTO_HASH_ALGORITHMS = {
+    20: "sha1",
+    32: "sha256",
+    48: "sha384",
+    64: "sha512",
+}
+
+# Returns the hash algorithm used for a "hash photo" (hex) - returns None if unknown
+def photo_hash_algorithm(hash_photo):
+    return _PHOTO_HASH_ALGORITHMS.get(len(hash_photo) // 2)
+
+# Checks if photo matches the "hash photo" (hex) of the card - returns false if not or if the hash algorithm is unknown
+def verify_photo(photo, hash_photo):
+    algorithm = photo_hash_algorithm(hash_photo)
+    if not algorithm:
+        return False
+    return hashlib.new(algorithm, photo).hexdigest() == hash_photo.lower()
+
+# Raised when a read photo does not match the "hash photo" of the card
+class eIDPhotoMismatchError(Exception):
+    pass
+
+class eIDPhotoCache:
+
+    # Construct - photos are kept as files in directory, the least recently used photos are removed when exceeding max_bytes
+    def __init__(self, directory, max_bytes = 50 * 1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+        # Cache statistics
+        self.hits = 0
+        self.misses = 0
+
+    # Methods
+
+    ## Returns the photo with hash_photo - returns None if not cached
+    def get(self, hash_photo):
+        path = self._path(hash_photo)
+        try:
+            with open(path, "rb") as file:
+                photo = file.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        # A corrupt file is removed and counts as a miss
+        if not verify_photo(photo, hash_photo):
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        self.hits += 1
+        return photo
+
+    ## Adds a photo to the cache - returns true if added, false if the photo does not match hash_photo
+    ## Pass verified if the photo was already checked against hash_photo, e.g. while it was read
+    def put(self, hash_photo, photo, verified = False):
+        if not verified and not verify_photo(photo, hash_photo):
+            return False
+
+        # Write to temporary file first - other processes never read a half written photo
+        file_descriptor, temporary_path = tempfile.mkstemp(dir = self._directory, suffix = ".tmp")
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(photo)
+        os.replace(temporary_path, self._path(hash_photo))
+
+        self._evict()
+        return True
+
+    ## Returns the cache statistics
+    def stats(self):
+        photos = self._photos()
+        return {
+            "photos": len(photos),
+            "bytes": sum(size for _, size, _ in photos),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    # Returns the path of the photo with hash_photo
+    def _path(self, hash_photo):
+        return os.path.join(self._directory, f"{hash_photo.lower()}.jpg")
+
+    # Returns all cached photos as (path, size, last used) tuples
+    def _photos(self):
+        photos = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(".jpg"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                photos.append((entry.path, stat.st_size, stat.st_mtime))
+        return photos
+
+    # Removes the least recently used photos until the cache fits max_bytes
+    def _evict(self):
+        photos = sorted(self._photos(), key = lambda photo: photo[2])
+        total = sum(size for _, size, _ in photos)
+        for path, size, _ in photos:
+            if total <= self._max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    # Removes a file - another process may have removed it already
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
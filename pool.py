@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from connection import reader_cache
+from reader import eIDReader
+from store import eIDContactStore
+import threading
+import time
+
+class eIDReaderPool:
+
+    # Construct - name is used to only open card readers that start with name, leave empty to open every card reader
+    # Pass a store (eIDContactStore) to limit the amount of kept contacts - the pooled readers keep their contacts in this store as well
+    def __init__(self, name = "", store = None):
+        self._name = name
+        self._lock = threading.Lock()
+
+        # Pooled card readers by reader name - every reader has its own worker so APDUs of one reader never interleave
+        self._readers = {}
+        self._bound = {}
+        self._workers = {}
+        self._stats = {}
+
+        # Hooks added to every card reader - see metrics.py
+        self._hooks = []
+
+        # Read eID contacts by card number - shared by all card readers
+        self._contacts = store if store != None else eIDContactStore()
+
+        self.refresh()
+
+    # Methods
+
+    ## Looks for plugged in and removed card readers - returns the added and removed reader names
+    def refresh(self):
+        found = {str(reader): reader for reader in reader_cache.get(refresh = True) if str(reader).lower().startswith(self._name.lower())}
+        with self._lock:
+            added = [name for name in found if name not in self._workers]
+            removed = [name for name in self._workers if name not in found]
+
+            # Open new card readers - the eIDReader is created on the worker when a card is read
+            for name in added:
+                self._workers[name] = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = name)
+                self._readers[name] = None
+                self._stats.setdefault(name, { "reads": 0, "failures": 0, "apdus": 0, "seconds": 0.0 })
+                self._bound[name] = found[name]
+
+            # Close removed card readers - reads that are still running will fail on their own
+            for name in removed:
+                self._workers.pop(name).shutdown(wait = False, cancel_futures = True)
+                self._readers.pop(name, None)
+                self._bound.pop(name, None)
+
+        return added, removed
+
+    ## Returns the names of the pooled card readers
+    def reader_names(self):
+        with self._lock:
+            return list(self._workers)
+
+    ## Starts reading the card in the given card reader - returns a future of the read eIDContact
+    def submit(self, reader_name, files = None, selected_data = None):
+        with self._lock:
+            if reader_name not in self._workers:
+                raise Exception(f"Could not find card reader '{reader_name}' in pool. Pooled card readers are: {', '.join(self._workers)}")
+            return self._workers[reader_name].submit(self._read, reader_name, files, selected_data)
+
+    ## Drops the connection to the card in the given card reader (e.g. when the card was removed) - the next read connects again without a reset
+    ## Runs on the worker of that card reader, after the reads that were submitted before - returns a future, or None when the card reader is not pooled
+    def disconnect(self, reader_name):
+        with self._lock:
+            if reader_name not in self._workers:
+                return None
+            return self._workers[reader_name].submit(self._disconnect, reader_name)
+
+    ## Reads the cards in all card readers in parallel - returns a dictionary with the eIDContact or exception by reader name
+    def read_all(self, files = None, selected_data = None, timeout = None):
+        self.refresh()
+        futures = {name: self.submit(name, files, selected_data) for name in self.reader_names()}
+        wait(futures.values(), timeout = timeout)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                results[name] = TimeoutError(f"Read timed out on card reader '{name}'")
+            elif future.cancelled():
+                results[name] = Exception(f"Read cancelled - card reader '{name}' was removed")
+            else:
+                results[name] = future.exception() or future.result()
+        return results
+
+    ## Returns the contact with card_number - returns None if not read yet
+    def get_contact(self, card_number):
+        with self._lock:
+            return self._contacts.get(card_number)
+
+    ## Returns all read contacts
+    def get_contacts(self):
+        with self._lock:
+            return list(self._contacts)
+
+    ## Returns the last read contact
+    def get_last_read(self):
+        with self._lock:
+            contact = self._contacts.last()
+            if not contact:
+                raise Exception(f"No eID contacts read yet - please read one first")
+            return contact
+
+    ## Returns the read statistics by reader name - reads per second is based on the time spent reading
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for name, reader_stats in self._stats.items():
+                stats[name] = dict(reader_stats)
+                stats[name]["plugged_in"] = name in self._workers
+                stats[name]["reads_per_second"] = reader_stats["reads"] / reader_stats["seconds"] if reader_stats["seconds"] > 0 else 0.0
+            return stats
+
+    ## Adds a hook to every card reader of the pool, also to card readers that are plugged in later (see eIDReader.add_hook)
+    def add_hook(self, hook):
+        with self._lock:
+            self._hooks.append(hook)
+            readers = [reader for reader in self._readers.values() if reader]
+        for reader in readers:
+            reader.add_hook(hook)
+
+    ## Closes all card readers of the pool
+    def close(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+            self._readers.clear()
+            self._bound.clear()
+        for worker in workers:
+            worker.shutdown(wait = True)
+
+    # Drops the connection of the given card reader - runs on the worker of that card reader
+    def _disconnect(self, reader_name):
+        reader = self._readers.get(reader_name)
+        if reader:
+            reader._disconnect()
+
+    # Reads the card in the given card reader - runs on the worker of that card reader
+    def _read(self, reader_name, files, selected_data):
+        start = time.perf_counter()
+        apdu_count = 0
+        try:
+
+            # Create the reader on first use - it connects to the card on its first read
+            reader = self._readers.get(reader_name)
+            if not reader:
+                reader = eIDReader(reader = self._bound[reader_name], store = self._contacts)
+                with self._lock:
+                    for hook in self._hooks:
+                        reader.add_hook(hook)
+                self._readers[reader_name] = reader
+
+            session = reader.session(files, selected_data)
+            try:
+                contact = session.run()
+            finally:
+                apdu_count = session.apdu_count
+        except Exception:
+            self._update_stats(reader_name, start, apdu_count, False)
+            raise
+
+        # Mark the contact as the last read contact of the pool
+        self._update_stats(reader_name, start, apdu_count, True)
+        with self._lock:
+            self._contacts.save(contact)
+        return contact
+
+    # Updates the statistics of a card reader after a read
+    def _update_stats(self, reader_name, start, apdu_count, success):
+        with self._lock:
+            reader_stats = self._stats[reader_name]
+            reader_stats["reads" if success else "failures"] += 1
+            reader_stats["apdus"] += apdu_count
+            reader_stats["seconds"] += time.perf_counter() - start
@@ -1,22 +1,146 @@
-from smartcard.Exceptions import NoCardException
-from smartcard.util import toHexString
-from smartcard.System import readers
 from contact import eIDContact
+from decoder import get_decoder, ADDRESS_MAPPING, REGISTRE_NATIONAL_MAPPING
+from session import eIDReadSession
+from transport import PyscardTransport
+from connection import eIDBackoff, eIDCardRemovedError, eIDReaderGoneError, eIDTransientError, reader_capabilities
+from store import eIDContactStore
+from metrics import eIDEvent
+from concurrent.futures import Future
+from photo_cache import photo_hash_algorithm, eIDPhotoMismatchError
+from collections import OrderedDict
+import hashlib
+import inspect
+import threading
 import time
 import json
 
+# Measures a method as a phase of a read and emits an eIDEvent to the hooks of the reader - does nothing if no hooks are added
+# A generator is measured from the first chunk until it is exhausted
+def _phase(name):
+    def decorator(method):
+        if inspect.isgeneratorfunction(method):
+            def measured_generator(self, *args, **kwargs):
+                if not self._hooks:
+                    return (yield from method(self, *args, **kwargs))
+                start = time.perf_counter()
+                error = None
+                try:
+                    return (yield from method(self, *args, **kwargs))
+                except Exception as e:
+                    error = str(e)
+                    raise
+                finally:
+                    self._emit(eIDEvent("phase", self._transport.name, self._file, phase = name, seconds = time.perf_counter() - start, retry = self._retry, error = error))
+            return measured_generator
+
+        def measured(self, *args, **kwargs):
+            if not self._hooks:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            error = None
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                self._emit(eIDEvent("phase", self._transport.name, self._file, phase = name, seconds = time.perf_counter() - start, retry = self._retry, error = error))
+        return measured
+    return decorator
+
+# Makes a read method safe to call from several threads - card access is serialized per reader and identical reads that are running are shared
+def _synchronized(method):
+    def synchronized(self, *args, **kwargs):
+        return self._single_flight((method.__name__, repr(args), repr(sorted(kwargs.items()))), lambda: method(self, *args, **kwargs))
+    return synchronized
+
+# Makes a method with side effects (e.g. writing to a file of the caller) safe to call from several threads - card access is serialized per reader, calls are never shared
+def _serialized(method):
+    def serialized(self, *args, **kwargs):
+        return self._locked(lambda: method(self, *args, **kwargs))
+    return serialized
+
+# A file that was selected is not on the card (0x6A82) or the path is not allowed (0x6A86) - selecting it again does not help, so it is never retried
+class eIDFileNotFoundError(Exception):
+    pass
+
 class eIDReader:
 
     # General used for class
-    _reader = None
-    _connection = None
+    _transport = None
     _name = None
 
-    # Read eID contacts
-    eID_contacts = []
+    # Read eID contacts - every reader has its own store
+    contacts = None
+
+    # Photos by "hash photo" - used to skip reading the photo file
+    photo_cache = None
+
+    # Amount of APDU commands sent to the card by this reader
+    _apdu_count = 0
+
+    # Hooks that are called with an eIDEvent for every APDU and phase - see metrics.py
+    _hooks = ()
+
+    # Currently selected file and the number of retries the last select needed - used for events
+    _file = None
+    _retry = 0
+
+    # Retry policy when a select fails - amount of tries and the wait between tries (see connection.py)
+    backoff = None
+
+    # Check the photo against the "hash photo" of the card while it is read - read_photo tries _photo_tries times when it does not match
+    verify_photo = True
+    _photo_tries = 2
+
+    # Lock of the connection - only one thread talks to the card at a time, the thread holding it is kept in _owner
+    _lock = None
+    _owner = None
+
+    # Reads that are running by method and arguments - a thread asking for the same read waits for its result
+    _flights = None
+    _flights_lock = None
+    _shared_reads = 0
+
+    # Connected to the card - construction does not connect, the first APDU (or warmup) does
+    _connected = False
+
+    # Learned file sizes by chip number and file - a hint to read a file without probing for the end of the file (see _read)
+    # Ordered from least to most recently used, only the last _MAX_FILE_SIZES are kept
+    _file_sizes = None
+    _MAX_FILE_SIZES = 1024
 
     # Static values used for communication
 
+    ## Maximum amount of bytes read with a single READ BINARY command
+    _MAX_READ_LENGTH = 256
+
+    ## Maximum amount of bytes read with a single extended length READ BINARY command - only tried on card readers using T=1
+    _MAX_EXTENDED_READ_LENGTH = 0xFFFF
+
+    ## First status byte of an extended length READ BINARY that is rejected - wrong length (0x67), instruction (0x6D) or class (0x6E) not supported
+    _EXTENDED_REJECTED = (0x67, 0x6D, 0x6E)
+
+    ## Length of the first two TLV's of the "Registre national" file - card number (1 + 1 + 12) and chip number (1 + 1 + 16)
+    _CARD_NUMBER_HEADER_LENGTH = 32
+
+    ## Files that can be read by name - path from the master file (3F00), DF00 holds the certificates and DF01 the identity files
+    FILES = {
+        "RN": "3F00DF014031",
+        "RN SIGNATURE": "3F00DF014032",
+        "ADDRESS": "3F00DF014033",
+        "ADDRESS SIGNATURE": "3F00DF014034",
+        "PHOTO": "3F00DF014035",
+        "AUTHENTICATION CERTIFICATE": "3F00DF005038",
+        "SIGNING CERTIFICATE": "3F00DF005039",
+        "CA CERTIFICATE": "3F00DF00503A",
+        "ROOT CERTIFICATE": "3F00DF00503B",
+        "RRN CERTIFICATE": "3F00DF00503C",
+    }
+
+    ## SELECT commands by file name or path - created the first time a file is selected
+    _select_commands = {}
+
     ## Basic read setup for ID-card - this will read the last selected file data on the chip
     _READ_COMMAND = [
                 0x00, # CLA   
@@ -26,181 +150,250 @@ class eIDReader:
                 0x00  # Length
     ]
 
-    ## Select setup for selecting "Registre national" (RN) file on chip - this will select the "Registre national" file
-    _SELECT_REGISTRE_NATIONAL = [
-                0x00, # CLA 
-                0xA4, # INS 
-                0x08, # P1
-                0x0C, # P2
-                0x06, # Length
-                0x3F, # Directory high (0xYY..)
-                0x00, # Directory low (0x..YY)
-                0xDF, # Subdirectory high (0xYY..)
-                0x01, # Subdirectory low (0xYY..)
-                0x40, # Registre national file high (0xYY..)
-                0x31  # Registre national file low (0x..YY)
-    ]
-
-    ## Select setup for selecting "address" file on chip - this will select the "address" file
-    _SELECT_ADDRESS = [  
-                0x00, # CLA  
-                0xA4, # INS 
-                0x08, # P1
-                0x0C, # P2
-                0x06, # Length
-                0x3F, # Directory high (0xYY..)
-                0x00, # Directory low (0x..YY)
-                0xDF, # Subdirectory high (0xYY..)
-                0x01, # Subdirectory low (0xYY..)
-                0x40, # Address file high (0xYY..)
-                0x33  # Address file low (0x..YY)
-    ]
-
-    ## Select setup for selecting "Photo" file on chip - this will select the "Photo" file
-    _SELECT_PHOTO = [  
-            0x00, # CLA 
-            0xA4, # INS 
-            0x08, # P1
-            0x0C, # P2
-            0x06, # Length
-            0x3F, # Directory high (0xYY..)
-            0x00, # Directory low (0x..YY)
-            0xDF, # Subdirectory high (0xYY..)
-            0x01, # Subdirectory low (0xYY..)
-            0x40, # Photo file high (0xYY..)
-            0x35  # Photo file low (0x..YY)
-    ]
-
-    # Static values used for mapping tags and selecting encoding
+    # Static values used for mapping tags and selecting encoding - see decoder.py
 
     ## Mapping for "Address" file
-    _ADDRESS_MAPPING = {
-        1: { "name": "street", "encoding": "utf-8" },
-        2: { "name": "zip_code", "encoding": "ascii" }, 
-        3: { "name": "municipality", "encoding": "utf-8" },
-    }
+    _ADDRESS_MAPPING = ADDRESS_MAPPING
 
     ## Mapping for "Registre national" file
-    _REGISTRE_NATIONAL_MAPPING = {
-        1: { "name": "card number", "encoding": "ascii" },
-        2: { "name": "chip number", "encoding": "" }, 
-        3: { "name": "card validity begin", "encoding": "ascii" },
-        4: { "name": "card validity end", "encoding": "ascii" },
-        5: { "name": "card delivery municipality", "encoding": "utf-8" },
-        6: { "name": "national number", "encoding": "ascii" },
-        7: { "name": "name", "encoding": "utf-8" },
-        8: { "name": "two first given names", "encoding": "utf-8" },
-        9: { "name": "first letter of third name", "encoding": "utf-8" },
-        10: { "name": "nationality", "encoding": "utf-8" },
-        11: { "name": "birthplace", "encoding": "utf-8" },
-        12: { "name": "birthdate", "encoding": "utf-8" },
-        13: { "name": "sex", "encoding": "ascii" },
-        14: { "name": "noble condition", "encoding": "utf-8" },
-        15: { "name": "document type", "encoding": "ascii" },
-        16: { "name": "special status", "encoding": "ascii" },
-        17: { "name": "hash photo", "encoding": "" },
-    }
+    _REGISTRE_NATIONAL_MAPPING = REGISTRE_NATIONAL_MAPPING
 
-    # Validate object before creating
-    def __new__(cls, name = ""):
+    # Validate object before creating - pass a reader (from smartcard.System.readers) to bind the object to that exact reader
+    # Pass a store (eIDContactStore) to limit the amount of kept contacts or to share contacts between readers
+    # Pass a photo_cache (eIDPhotoCache) to skip reading photos that were read before
+    # Pass a transport (see transport.py) to talk to the card in another way than a PC/SC reader, e.g. a simulated card
+    def __new__(cls, name = "", reader = None, store = None, photo_cache = None, transport = None):
         obj = super().__new__(cls)
         obj._name = name
-        obj._init_reader()
+        obj._transport = transport if transport != None else PyscardTransport(name, reader)
+        obj.contacts = store if store != None else eIDContactStore()
+        obj.photo_cache = photo_cache
+        obj._file_sizes = OrderedDict()
+        obj.backoff = eIDBackoff()
+        obj._lock = threading.RLock()
+        obj._flights = {}
+        obj._flights_lock = threading.Lock()
         return obj
 
-    # Init the reader - this will create a new smartcard object
+    # Init the reader - this will connect to the card, a connection that was made before is dropped
+    # Not called when constructing - the card readers are looked up and the card is connected on the first APDU
     def _init_reader(self):
+        with self._lock:
+            self._transport.connect()
+            self._connected = True
+
+    # Connects to the card again with a warm reset - e.g. after a new card was inserted
+    def _reconnect(self):
+        with self._lock:
+            self._transport.reconnect()
+            self._connected = True
+
+    # Disconnects from the card - the next read connects again
+    def _disconnect(self):
+        with self._lock:
+            self._transport.disconnect()
+            self._connected = False
+
+    # Runs function while holding the lock of the connection - returns its result
+    # When the same read (key) is running in another thread, its result is returned (or its exception raised) instead
+    # Calls made while already holding the lock (e.g. read_photo within a session) run right away
+    def _single_flight(self, key, function):
+        if self._owner == threading.get_ident():
+            return function()
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight == None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self._shared_reads += 1
+        if not leader:
+            return flight.result()
 
-        # Check what for reader should be looked for
-        if self._name != "":
-            reader = next((reader for reader in readers() if reader.name.lower().startswith(self._name.lower())), None)
-            if not reader:
-                raise Exception(f"Could not find card reader. Please make sure a card reader that starts with '{self._name.lower()}' is plugged in. The following card readers are found:\n{readers()}")
-        else:
-            if len(readers()) <= 0:
-                raise Exception("Could not find card reader.")
-            reader = readers()[0]
-
-        # Disconnect current reader if a connection was made - a new card maybe inserted
-        if self._connection:
-            self._connection.disconnect()
-        
-        # Init reader on object
-        self._reader = reader
-        self._connection = reader.createConnection()
-        self._connection.connect()
-
-    # Check if the card is responding to a select
-    def _select_and_validate(self, file = "RV", retry = 3):
-
-        # Check if retry counter is done!
-        if retry <= 0:
-            raise Exception(f"The eID card reader is not responding - or no card is inserted.")
-
-        # Try to select a file
+        error = None
         try:
-            self._select(file)
-        except:
-
-            # Wait to try again
-            time.sleep(0.25)
-
-            # Reset the card - a new eID may has been inserted
-            self._init_reader()
-
-            # Read again
-            self._select_and_validate(file, retry - 1)
-        
-        return True
+            result = self._locked(function)
+        except BaseException as e:
+            error = e
+
+        # Forget the flight before waking the waiting threads - a read asked for after this reads the card again
+        with self._flights_lock:
+            self._flights.pop(key, None)
+        if error:
+            flight.set_exception(error)
+            raise error
+        flight.set_result(result)
+        return result
+
+    # Runs function while holding the lock of the connection as its owner - returns its result
+    # Calls made while already holding the lock run right away
+    def _locked(self, function):
+        owner = threading.get_ident()
+        if self._owner == owner:
+            return function()
+        with self._lock:
+            self._owner = owner
+            try:
+                return function()
+            finally:
+                self._owner = None
+
+    # Check if the card is responding to a select - recovers from errors by the kind of error and tries again (see backoff)
+    # A transient error selects again (and reconnects when it repeats), a removed card (or unexpected response) reconnects with a warm reset, a gone card reader looks for card readers again
+    @_phase("select")
+    def _select_and_validate(self, file = "RN"):
+        self._select_command(file)
+        for attempt in range(self.backoff.tries):
+            self._retry = attempt
+            try:
+                if attempt > 0:
+                    self._recover(error, attempt)
+                return self._select(file)
+            except eIDFileNotFoundError:
+                raise
+            except Exception as e:
+                error = e
+
+            # Last try failed - no need to wait
+            if attempt + 1 >= self.backoff.tries:
+                break
+            time.sleep(self.backoff.wait(attempt + 1, error))
+
+        if isinstance(error, (eIDCardRemovedError, eIDReaderGoneError, eIDTransientError)):
+            raise error
+        raise Exception(f"The eID card reader is not responding - or no card is inserted.") from error
+
+    # Recovers from the error of the previous try - attempt is the number of the retry (1 is the first retry)
+    # A transient error is retried without reconnecting once, when it happens again the card is reconnected
+    def _recover(self, error, attempt = 1):
+        if isinstance(error, eIDTransientError) and attempt <= 1:
+            return
+        if isinstance(error, eIDReaderGoneError):
+            self._transport.connect(refresh = True)
+        else:
+            self._transport.reconnect()
+        self._connected = True
 
     # Methods
     def get_last_read(self):
-        if len(self.eID_contacts) <= 0:
+        contact = self.contacts.last()
+        if not contact:
             raise Exception(f"No eID contacts read yet - please read one first")
-        
-        # Get last read contact based on updated timestamp
-        sorted_contacts = sorted(self.eID_contacts, key=lambda contact: contact.updated, reverse=True)
-        return sorted_contacts[0]
+        return contact
+
+    ## All read eID contacts - from least to most recently read
+    @property
+    def eID_contacts(self):
+        return list(self.contacts)
 
-    ## Selects the correct file for reading - returns true for success - raises exception for error
+    ## Selects the correct file for reading - file is a name (see FILES) or a path (e.g. "3F00DF014031" or "3F00/DF01/4031") - returns true for success - raises exception for error
     def _select(self, file="RN"):
-        selected_file = []
-        match file.upper():
-            case "RN":
-                selected_file = self._SELECT_REGISTRE_NATIONAL
-            case "ADDRESS":
-                selected_file = self._SELECT_ADDRESS
-            case "PHOTO":
-                selected_file = self._SELECT_PHOTO
-            case _:
-                raise Exception("Select failed - value not allowed. Allowed values are RN|ADDRESS|PHOTO")
+        selected_file = self._select_command(file)
+        self._file = file.upper()
 
         # Transmit to chip in order to select file
         response, sw1, sw2 = self._transmit(selected_file)
 
-        # Check if transmission was received and handled
+        # Check if transmission was received and handled - a file that is not on the card is not an error of the connection
+        if sw1 == 0x6A and sw2 in (0x82, 0x86):
+            raise eIDFileNotFoundError(f"Select failed - file '{file}' not found on the card. Returned code '{hex(sw1) + hex(sw2)[2:]}'")
         if not self._validate_transmit(sw1, sw2):
             raise Exception(f"Select failed - response code not expected. Expected code '0x900', returned code '{hex(sw1) + hex(sw2)[2:]}'")
         
         return True
 
+    # Creates the SELECT command (select by path from the master file) for a file name or path - returns the command
+    def _select_command(self, file):
+        command = self._select_commands.get(file)
+        if command:
+            return command
+        try:
+            path = bytes.fromhex(self.FILES.get(file.upper(), file).replace("/", "").replace(" ", ""))
+        except ValueError:
+            path = b""
+        if len(path) < 2 or len(path) % 2 != 0 or len(path) > 255:
+            raise Exception(f"Select failed - value not allowed. Allowed values are a path (e.g. 3F00DF014031) or {'|'.join(self.FILES)}")
+        command = self._select_commands[file] = [
+                0x00, # CLA
+                0xA4, # INS
+                0x08, # P1 - select by path from the master file
+                0x0C, # P2 - no response data
+                len(path), # Length
+        ] + list(path)
+        return command
+
     ## Transmits data to the current card reader (either selecting or retreiving data)
     def _transmit(self, data):
-        return self._connection.transmit(data)
+        if not self._connected:
+            self._init_reader()
+        self._apdu_count += 1
+        if not self._hooks:
+            return self._transport.transmit(data)
+
+        # Measure the APDU for the hooks
+        start = time.perf_counter()
+        try:
+            response, sw1, sw2 = self._transport.transmit(data)
+        except Exception as e:
+            self._emit(eIDEvent("apdu", self._transport.name, self._file, command = data, bytes_sent = len(data), seconds = time.perf_counter() - start, retry = self._retry, error = str(e)))
+            raise
+        self._emit(eIDEvent("apdu", self._transport.name, self._file, command = data, sw1 = sw1, sw2 = sw2, bytes_sent = len(data), bytes_received = len(response), seconds = time.perf_counter() - start, retry = self._retry))
+        return response, sw1, sw2
+
+    ## Records every APDU exchange to a capture file from now on - capture is a path or an eIDCaptureWriter (see capture.py) - returns the recorder
+    ## Recorded sessions can be replayed with ReplayTransport
+    def record(self, capture):
+        from capture import eIDRecorder
+        self._transport = eIDRecorder(self._transport, capture)
+        return self._transport
+
+    ## Adds a hook - hook is called with an eIDEvent for every APDU and every phase of a read (see metrics.py)
+    def add_hook(self, hook):
+        self._hooks = self._hooks + (hook,)
+
+    ## Removes a hook
+    def remove_hook(self, hook):
+        self._hooks = tuple(added for added in self._hooks if added is not hook)
+
+    # Calls all hooks with an event
+    def _emit(self, event):
+        for hook in self._hooks:
+            hook(event)
 
     ## Checks if the transmission was succesfull (response code should be 0x900)
     def _validate_transmit(self, sw1, sw2):
         return hex(sw1) + hex(sw2)[2:] == "0x900"
     
+    ## Looks up the card reader, connects to the card and probes the card reader now instead of on the first read - returns true for success - raises exception for error
+    ## For services that want to pay the setup cost when starting, a reader that is not warmed up does the same on its first read
+    @_synchronized
+    def warmup(self):
+        if not self._connected:
+            self._init_reader()
+        self._max_read_length()
+        for file in self.FILES:
+            self._select_command(file)
+        return True
+
     # Reads all data from the current inserted card -  returns true for success - raises exception for error
+    @_synchronized
     def read_card(self):
-        self.read_registre_national()
-        self.read_address()
-        self.read_photo()
+        self.session().run()
         return True
 
+    # Creates a read session - every file in files is selected and read exactly once when running the session
+    def session(self, files = None, selected_data = None):
+        return eIDReadSession(self, files, selected_data)
+
     ## Reads the "Registre national" file - returns true for success - raises exception for error
+    @_synchronized
     def read_registre_national(self, selected_data = None):
+        self._read_registre_national(selected_data)
+        return True
+
+    ## Reads the "Registre national" file - returns the read contact - raises exception for error
+    def _read_registre_national(self, selected_data = None):
 
         # Check selected_data and fill if empty also, select RN file before reading chip
         if not selected_data or len(selected_data) <= 0:
@@ -211,16 +404,48 @@ class eIDReader:
 
         # Read selected file and create contact object
         response = self._read()
-        self._crud_contact(response, selected_data, self._REGISTRE_NATIONAL_MAPPING)
-        return True
+        return self._crud_contact(response, selected_data, self._REGISTRE_NATIONAL_MAPPING)
+
+    ## Reads only the card number - returns the card number - raises exception for error
+    ## Only the first TLV of the "Registre national" file is read, so this is a cheap way to check which card is inserted
+    @_synchronized
+    def read_card_number(self):
+        return self._read_card_number()
+
+    ## Reads the card number from the first TLV of the "Registre national" file - returns card number - raises exception for error
+    ## Pass hash_photo to read the "hash photo" as well when it is not known for the card - the rest of the file is read on from the card number
+    def _read_card_number(self, hash_photo = False):
+        self._select_and_validate("RN")
+
+        # The card number (tag 1) and chip number (tag 2) are the first TLV's of the file - read just that part
+        # The chip number is used to find the learned file sizes of the card
+        header = self._read_chunks(self._CARD_NUMBER_HEADER_LENGTH)
+        if len(header) >= 2 and header[0] == 1 and header[1] + 2 > len(header):
+            header = self._read_chunks(header[1] + 2)
+
+        # Card does not start with the card number - read the whole file
+        selected_data = [ "card number", "chip number" ] + ([ "hash photo" ] if hash_photo else [])
+        if len(header) < 2 or header[0] != 1:
+            contact = self._read_registre_national(selected_data)
+        else:
+            contact = self._crud_contact(header, [ "card number", "chip number" ], self._REGISTRE_NATIONAL_MAPPING)
+
+            # The "hash photo" is one of the last TLV's - the file is still selected, so only the part after the header is read
+            if hash_photo and not contact.hash_photo:
+                data = header + self._read(self._chip_number(contact.card_number), len(header))
+                contact = self._crud_contact(data, selected_data, self._REGISTRE_NATIONAL_MAPPING)
+
+        if not contact or not contact.card_number:
+             raise Exception(f"Read failed - could not read card number - something went wrong")
+        return contact.card_number
     
     ## Reads the "Address" file - returns true for success - raises exception for error
-    def read_address(self, selected_data = None):
+    @_synchronized
+    def read_address(self, selected_data = None, card_number = None):
 
-        # First get the card_number before we can continue
-        if not self.read_registre_national([ "card number" ]) or len(self.eID_contacts) <= 0:
-             raise Exception(f"Read failed - could not read card number - something went wrong")
-        card_number = self.get_last_read().card_number
+        # First get the card_number before we can continue - a session passes the card number it already read
+        if not card_number:
+            card_number = self._read_card_number()
 
         # Check selected_data and fill if empty also, select RN file before reading chip
         if not selected_data or len(selected_data) <= 0:
@@ -230,86 +455,302 @@ class eIDReader:
         self._select_and_validate("ADDRESS")
 
         # Read selected file and create contact object
-        response = self._read()
+        response = self._read(self._chip_number(card_number))
         self._crud_contact(response, selected_data, self._ADDRESS_MAPPING, card_number)
         return True
     
     # Reads the current selected file - returns data if success - raises exception for error
-    def _read(self):
-
-        # Since we do not know how much data we need to read - we first must read the chip with length 0
-        # After doing so our sw2 will contain the length of our data
-        _, sw1, sw2 = self._transmit(self._READ_COMMAND)
-
-        # Check if length is returned - our sw1 should be "0x6C"
-        if hex(sw1) != "0x6c":
-            raise Exception(f"Select failed - response code not expected. Expected code '0x900', returned code '{hex(sw1) + hex(sw2)[2:]}'")
-        
-        # Create new read command depending on size
-        _READ_COMMAND_with_length = self._READ_COMMAND.copy()
-        _READ_COMMAND_with_length[len(_READ_COMMAND_with_length)-1] = sw2
-        response, sw1, sw2 = self._transmit(_READ_COMMAND_with_length)
-
-        # Check if transmission was received and handled
-        if not self._validate_transmit(sw1, sw2):
-            raise Exception(f"Read failed - response code not expected. Expected code '0x900', returned code '{hex(sw1) + hex(sw2)[2:]}'")
+    # When the chip number is given, the file size learned on an earlier read of the card is used as a hint - see below
+    # Pass offset to read only the part of the file from offset
+    @_phase("read")
+    def _read(self, chip_number = None, offset = 0):
+
+        # If the size of the file is not known - the status words of the card tell where the file ends
+        # With short reads a file up to 256 bytes takes two exchanges, with extended length one exchange
+        # Extended length reads find the end of the file in the same exchange, so the learned size is only used with short reads
+        key = (chip_number, bytes(self._select_command(self._file)[5:]))
+        size = self._file_sizes.get(key) if chip_number and self._max_read_length() <= self._MAX_READ_LENGTH else None
+        data = self._read_chunks(size, offset)
+
+        # The file may have been written again with more data since the size was learned (e.g. a new address on the same chip)
+        # When the data ends at the learned size the file is read on - one READ at the end, unless the file holds its own length (a certificate)
+        if size != None and offset + len(data) == size and not (offset == 0 and self._der_complete(data)):
+            data += self._read_chunks(None, size)
+        if chip_number:
+            self._learn_file_size(key, offset + len(data))
+        return data
+
+    # Checks if data is a complete DER structure (e.g. a certificate) - the length in its header matches the length of data
+    def _der_complete(self, data):
+        if len(data) >= 4 and data[0] == 0x30 and data[1] == 0x82:
+            return 4 + ((data[2] << 8) | data[3]) == len(data)
+        if len(data) >= 3 and data[0] == 0x30 and data[1] == 0x81:
+            return 3 + data[2] == len(data)
+        return False
 
-        return response
+    # Keeps the size of a file of a card - the least recently used sizes are dropped when more than _MAX_FILE_SIZES are kept
+    def _learn_file_size(self, key, size):
+        self._file_sizes[key] = size
+        self._file_sizes.move_to_end(key)
+        while len(self._file_sizes) > self._MAX_FILE_SIZES:
+            self._file_sizes.popitem(last = False)
+
+    ## Reads a file - file is a name (see FILES) or a path (e.g. "3F00DF005038") - returns the file as bytes - raises exception for error
+    def read_file(self, file, chip_number = None):
+        return self.read_files([ file ], chip_number)[file]
+
+    ## Reads several files in one batch - the card is identified once, every file is read with the fewest exchanges
+    ## Returns a dictionary with the file as bytes by the given name or path - raises exception for error
+    @_synchronized
+    def read_files(self, files, chip_number = None):
+        for file in files:
+            self._select_command(file)
+        if not chip_number:
+            chip_number = self._chip_number(self._read_card_number())
+
+        data = {}
+        for file in files:
+            self._select_and_validate(file)
+            data[file] = bytes(self._read(chip_number))
+        return data
+
+    # Returns the key of the learned file sizes of a card - the chip number, or the card number if the chip number was not read
+    def _chip_number(self, card_number):
+        contact = self._find_contact(card_number)
+        return contact.chip_number if contact and contact.chip_number else card_number
 
     ## Reads the "Photo" file - returns true for success - raises exception for error
-    def read_photo(self):
+    ## When the photo does not match the "hash photo" of the card only the photo is read again
+    @_synchronized
+    def read_photo(self, card_number = None):
+        if not card_number:
+            card_number = self._read_card_number(hash_photo = bool(self.photo_cache or self.verify_photo))
+        for attempt in range(self._photo_tries):
+            try:
+                for _ in self.iter_photo(card_number):
+                    pass
+                return True
+            except eIDPhotoMismatchError:
+                if attempt + 1 >= self._photo_tries:
+                    raise
+
+                # The learned file size may be the cause - probe for the end of the file again
+                self._file_sizes.pop((self._chip_number(card_number), bytes(self._select_command("PHOTO")[5:])), None)
+
+    ## Reads the "Photo" file and writes every chunk to file (a file like object with write, e.g. a file or socket) as soon as it is received
+    ## The contact is updated when the whole photo is read - returns the amount of written bytes - raises exception for error
+    @_serialized
+    def read_photo_to(self, file, card_number = None):
+        size = 0
+        for chunk in self.iter_photo(card_number):
+            file.write(chunk)
+            size += len(chunk)
+        return size
+
+    ## Reads the "Photo" file - yields every chunk (bytes) as soon as it is received from the card, a cached photo is yielded at once
+    ## Every chunk is added to a hash of the photo, so the photo is checked against the "hash photo" without reading it again
+    ## The photo is validated and the contact is updated after the last chunk - raises eIDPhotoMismatchError when the photo does not match
+    ## The lock of the connection is held while a chunk is read, not between chunks - a generator that is not consumed to the end never blocks other threads
+    ## Reads made between chunks (by any thread) are allowed - the photo is selected again before the next chunk
+    def iter_photo(self, card_number = None):
+        chunks = self._iter_photo(card_number)
+        try:
+            while True:
+                try:
+                    chunk = self._locked(lambda: next(chunks))
+                except StopIteration:
+                    return
+                yield chunk
+        finally:
+            chunks.close()
+
+    # Reads the "Photo" file - see iter_photo
+    def _iter_photo(self, card_number = None):
+
+        # First get the card_number before we can continue - a session passes the card number it already read
+        # The "hash photo" is needed to check or find the photo, so it is read together with the card number
+        if not card_number:
+            card_number = self._read_card_number(hash_photo = bool(self.photo_cache or self.verify_photo))
 
-        # First get the card_number before we can continue
-        if not self.read_registre_national([ "card number" ]) or len(self.eID_contacts) <= 0:
-             raise Exception(f"Read failed - could not read card number - something went wrong")
-        card_number = self.get_last_read().card_number
+        # Use the cached photo if the "hash photo" of the card is known and the photo was read before
+        # The "hash photo" is kept from an earlier read of the card, otherwise it is read from the "Registre national" file
+        contact = self._find_contact(card_number)
+        hash_photo = contact.hash_photo if contact else ""
+        if (self.photo_cache or self.verify_photo) and not hash_photo:
+            hash_photo = self._read_registre_national([ "card number", "hash photo" ]).hash_photo
+        if self.photo_cache and hash_photo:
+            photo = self.photo_cache.get(hash_photo)
+            if photo:
+                yield photo
+                self._crud_contact({ "photo": photo, "photo_verified": True }, None, None, card_number)
+                return
         self._select_and_validate("PHOTO")
 
-        # Loop over file to retreive in 256 byte chunks
-        photo = []
-        offset = 0
-        length = 256
+        # The hash algorithm depends on the applet version of the card - it is known by the length of the "hash photo"
+        algorithm = photo_hash_algorithm(hash_photo) if hash_photo else None
+        digest = hashlib.new(algorithm) if algorithm else None
+
+        # Read photo - if we read this card before we already know the file size and skip the length probe at the end
+        # The learned size is a hint - a photo that does not end with the JPG end marker (FFD9) at that size is read on
+        key = (self._chip_number(card_number), bytes(self._select_command("PHOTO")[5:]))
+        size = self._file_sizes.get(key)
+        photo = bytearray()
+        def chunks():
+            yield from self._iter_chunks(size)
+            if size and len(photo) == size and photo[-2:] != b"\xff\xd9":
+                yield from self._iter_chunks(None, size)
+        for chunk in chunks():
+            if not photo and chunk[:2] != b"\xff\xd8":
+                raise Exception("Read failed - could not read photo - something went wrong")
+            photo += chunk
+            if digest:
+                digest.update(chunk)
+            yield chunk
+        photo = bytes(photo)
+        if not self._validate_photo(photo):
+            raise Exception("Read failed - could not read photo - something went wrong")
+
+        # Check the photo - a photo that does not match is never kept
+        verified = digest != None and digest.hexdigest() == hash_photo.lower()
+        if digest and not verified and self.verify_photo:
+            raise eIDPhotoMismatchError("Read failed - photo does not match the hash photo of the card")
+        self._learn_file_size(key, len(photo))
+
+        # Cache photo - the photo is only cached if it matches the "hash photo"
+        if self.photo_cache and hash_photo and not self.photo_cache.put(hash_photo, photo, verified):
+            raise eIDPhotoMismatchError("Read failed - photo does not match the hash photo of the card")
+        self._crud_contact({ "photo": photo, "photo_verified": verified }, None, None, card_number)
+
+    # Reads the current selected file in chunks from offset - returns data if success - raises exception for error
+    # When the file size is known the buffer is allocated once and every chunk is written into it
+    def _read_chunks(self, size = None, offset = 0):
+        data = bytearray(max(0, size - offset) if size else 0)
+        length = 0
+        for chunk in self._iter_chunks(size, offset):
+            data[length:length + len(chunk)] = chunk
+            length += len(chunk)
+
+        # Drop the part of the buffer that was not read - the file was smaller than expected
+        del data[length:]
+        return data
+
+    # Reads the current selected file in chunks - yields every chunk (bytes) as soon as it is received - raises exception for error
+    # The status words of the card are used to find the end of the file, so the last chunk is read in one exchange
+    # A read made by the consuming thread between two chunks (e.g. read_address while streaming the photo) selects another file - the file is selected again before the next chunk
+    @_phase("read_chunks")
+    def _iter_chunks(self, size = None, offset = 0):
+        file = self._file
+        max_length = self._max_read_length()
+        length = max_length if size is None else min(max_length, size - offset)
+
+        # Length of a short answer to an extended length command - the end of the file, or the most the card reader or card returns at once
+        capped = None
         while length > 0:
+            if self._file != file:
+                self._select_and_validate(file)
+            try:
+                response, sw1, sw2 = self._transmit(self._read_command(offset, length))
+            except (eIDCardRemovedError, eIDReaderGoneError):
+                raise
+            except Exception:
+                if length <= self._MAX_READ_LENGTH:
+                    raise
+                response, sw1, sw2 = [], 0x67, 0x00
+
+            # Extended length rejected by the card reader or card - fall back to short reads, also for the next reads with this card reader
+            if length > self._MAX_READ_LENGTH and sw1 in self._EXTENDED_REJECTED:
+                max_length = self._set_max_read_length(self._MAX_READ_LENGTH)
+                length = max_length if size is None else min(max_length, size - offset)
+                continue
+
+            # Wrong length of an extended length command - sw2 can only hold the amount of bytes left when it is less than 256, so read on with a short read
+            if length > self._MAX_READ_LENGTH and sw1 == 0x6C:
+                length = self._MAX_READ_LENGTH if size is None else min(self._MAX_READ_LENGTH, size - offset)
+                continue
+
+            # Chunk received - continue with the next chunk
+            if sw1 == 0x90 and sw2 == 0x00:
+                if response:
+                    yield bytes(response)
+
+                    # More data after a short answer - the card reader or card limits the response size, use that size from now on
+                    if capped:
+                        max_length = self._set_max_read_length(max(capped, self._MAX_READ_LENGTH))
+                        capped = None
+                offset += len(response)
+
+                # A short answer to a short read means the file ended - a short answer to an extended length command does not,
+                # the end of the file is answered with 0x6282 or 0x6B00 on the next read
+                if len(response) < length:
+                    if length <= self._MAX_READ_LENGTH or not response:
+                        break
+                    capped = len(response)
+                length = max_length if size is None else min(max_length, size - offset)
+
+            # Wrong length - sw2 contains the amount of bytes left in the file (0x6Cxx), so now we know the file size
+            elif sw1 == 0x6C:
+                if (sw2 or 256) == length:
+                    raise Exception(f"Read failed - card keeps returning wrong length '{hex(sw1) + hex(sw2)[2:]}'")
+                length = sw2 or 256
+                size = offset + length
+
+            # End of file reached before reading the requested length (0x6282) - response holds the last bytes
+            elif sw1 == 0x62 and sw2 == 0x82:
+                if response:
+                    yield bytes(response)
+                break
+
+            # Offset outside of file (0x6B00) - the previous chunk ended exactly at the end of the file
+            elif sw1 == 0x6B and sw2 == 0x00 and offset > 0:
+                break
 
-            # Convert offset to hex and extract last two characters
-            offset_hex = hex(offset)[2:].zfill(4)
-            p1_hex = offset_hex[:2]
-            p2_hex = offset_hex[2:]
-            file = [  
+            else:
+                raise Exception(f"Read failed - response code not expected. Expected code '0x900', returned code '{hex(sw1) + hex(sw2)[2:]}'")
+
+    # Returns the maximum amount of bytes to read with one READ BINARY command - the card reader is probed once and cached by name
+    # Extended length is only tried with T=1 - the first extended length reads learn the real limit (see _iter_chunks),
+    # if the card reader or card rejects extended length the cache is set to short reads
+    def _max_read_length(self):
+        capabilities = reader_capabilities.get(self._transport.name)
+        if capabilities == None:
+            protocol = self._transport.protocol()
+            reader_capabilities.set(self._transport.name, protocol, self._MAX_EXTENDED_READ_LENGTH if protocol == "T1" else self._MAX_READ_LENGTH)
+            capabilities = reader_capabilities.get(self._transport.name)
+        return capabilities["max_read_length"]
+
+    # Sets the maximum amount of bytes to read with one READ BINARY command for the card reader - returns the length
+    def _set_max_read_length(self, length):
+        reader_capabilities.set(self._transport.name, self._transport.protocol(), length)
+        return length
+
+    # Creates a READ BINARY command for the current selected file - returns the command
+    # More than 256 bytes are read with an extended length command (Le of 3 bytes)
+    def _read_command(self, offset, length):
+        if length > self._MAX_READ_LENGTH:
+            return [
                     0x00, # CLA
                     0xB0, # INS
-                    int(p1_hex, 16), # P1
-                    int(p2_hex, 16), # P2
-                    length # LENGTH
+                    (offset >> 8) & 0xFF, # P1 - offset high
+                    offset & 0xFF, # P2 - offset low
+                    0x00, # Extended length marker
+                    (length >> 8) & 0xFF, # LENGTH high
+                    length & 0xFF # LENGTH low
             ]
-
-            # Get response for file for chunk 
-            response, sw1, sw2 = self._transmit(file)
-
-            # Check if photo is complete
-            photo_validated = self._validate_photo(response)
-            if photo_validated:
-                photo += response
-                self._crud_contact({ "photo": bytearray(photo) }, None, None, card_number)
-                return True
-            
-            # Photo not complete, change offset or length of data
-            if(len (response) <= 0 and not photo_validated):
-                length -= 1
-            else:
-                offset += 256
-                photo += response
-
-        # Error
-        raise Exception("Read failed - could not read photo - something went wrong")
-
-    # A JPG should end with a certain marker (FFD9) - returns true if FFD9 - false if not
+        return [
+                0x00, # CLA
+                0xB0, # INS
+                (offset >> 8) & 0xFF, # P1 - offset high
+                offset & 0xFF, # P2 - offset low
+                length & 0xFF # LENGTH - 0x00 means 256 bytes
+        ]
+
+    # A JPG should start with a certain marker (FFD8) and end with a certain marker (FFD9) - returns true if valid - false if not
     def _validate_photo(self, data):
-        if len(data) >= 2:
-            return data[len(data) - 2] == 255 and data[len(data) - 1] == 217
+        if len(data) >= 4:
+            return data[0] == 255 and data[1] == 216 and data[len(data) - 2] == 255 and data[len(data) - 1] == 217
         return False
 
-    # Creates or updates a eID contact after reading the data - returns data if success - raises exception for error
+    # Creates or updates a eID contact after reading the data - returns the contact if success - raises exception for error
     def _crud_contact(self, data, selected_data, mapping, card_number = None ):
 
         # If card_number is not set, this means we have a RN read
@@ -322,68 +763,34 @@ class eIDReader:
             raise Exception("Could not get card_number - something went wrong")
 
         # Check if contact exists with card_number - if so, update - else create
-        contact = self._find_contact(card_number)
-        if not contact:
-            contact = eIDContact(card_number)
-            contact._save(self._decode_data(data, mapping, selected_data))
-            self.eID_contacts.append(contact)
-        else:
-            contact._save(self._decode_data(data, mapping, selected_data))
+        # Decoding is done first, finding, updating and saving the contact is one step for other threads using the store
+        data = self._decode_data(data, mapping, selected_data)
+        with self.contacts.lock:
+            contact = self._find_contact(card_number)
+            if not contact:
+                contact = eIDContact(card_number)
+            contact._save(data)
 
-        return True
+            # Save contact in store - this also marks the contact as the last read one
+            return self.contacts.save(contact)
 
     # Tries to find a contact with card_number - returns contact object if found - false if not found
     def _find_contact(self, card_number):
-        for contact in self.eID_contacts:
-            if contact.card_number == card_number:
-                return contact
-        return False
+        return self.contacts.get(card_number) or False
 
     # Used to parse the card_number from the data
     def _get_card_number(self, data, mapping):
-        
-        # Create new dictonary where ID = 1 so we get the mapping for the card_number
-        filtered_mapping = {k: v for k, v in mapping.items() if k == 1}
-        return self._decode_data(data, filtered_mapping)
+        return self._decode_data(data, mapping, [ "card number" ])
     
-    # Decodes all data
+    # Decodes all data - the mapping is compiled once into a decoder, see decoder.py
+    @_phase("decode")
     def _decode_data(self, data, mapping, selected_data = None):
 
         # Check if no mapping needed (mapping happend in other method like 'read_photo')
         if mapping == None:
             return data
 
-        # Set locals
-        pointer = 0
-        response = {}
-        loops = 0
-
-        # Convert original data to bytearray - cause python likes intarrays more ;-)
-        data = bytearray(data)
-
-        # Loop over data
-        while loops < len(mapping):
-
-            # Get current mapping and data length
-            mapping_object = mapping[data[pointer]]
-            key = mapping_object["name"]
-            pointer += 1
-            length = data[pointer]
-            pointer += 1
-
-            # Get value and encode following the mapped encoding - if no encoding use hex
-            if mapping_object["encoding"]:
-                value = data[pointer:pointer + length].decode(mapping_object["encoding"])
-            else:
-                value = data[pointer:pointer + length].hex()
-            pointer += length
-
-            # Create key/value pair if in selected_data or if none
-            if selected_data == None or key in selected_data:
-                response[key] = value
-            loops += 1
-        
-        return response
+        return get_decoder(mapping).decode(data, selected_data)
 
     ## Check if selected_data is valid - returns true for valid - raises exception for invalid
     def _check_selected_data (self, selected_data, mappings):
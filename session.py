@@ -0,0 +1,62 @@
+class eIDReadSession:
+
+    # Files that can be read in a session - in the order they are read from the chip
+    FILES = ("RN", "ADDRESS", "PHOTO")
+
+    # Construct - files is a list of files to read (RN|ADDRESS|PHOTO), selected_data is a dictionary with the fields to read per file
+    def __init__(self, reader, files = None, selected_data = None):
+        self._reader = reader
+
+        # Check files and fill if empty
+        if not files or len(files) <= 0:
+            files = self.FILES
+        files = {file.upper() for file in files}
+        invalid_files = files - set(self.FILES)
+        if invalid_files:
+            raise ValueError(f"Invalid files found: {', '.join(invalid_files)}. Allowed files are: {', '.join(self.FILES)}.")
+        self.files = [file for file in self.FILES if file in files]
+
+        # Check selected_data - the keys are checked against the mapping of each file when reading
+        self.selected_data = {}
+        for file, fields in (selected_data or {}).items():
+            if file.upper() not in self.FILES:
+                raise ValueError(f"Invalid file found in selected data: {file}. Allowed files are: {', '.join(self.FILES)}.")
+            self.selected_data[file.upper()] = fields
+
+        # Result of the session
+        self.contact = None
+        self.apdu_count = 0
+
+    # Methods
+
+    ## Reads every file of the session exactly once - returns the read contact - raises exception for error
+    ## When the same session is running in another thread, its contact is returned instead of reading the card again
+    def run(self):
+        self.contact = self._reader._single_flight(("session", repr(self.files), repr(sorted(self.selected_data.items()))), self._run)
+        return self.contact
+
+    # Reads every file of the session - runs while holding the lock of the reader
+    def _run(self):
+        apdu_count = self._reader._apdu_count
+        try:
+
+            # The "Registre national" file contains the card number - every other file needs it
+            # The "hash photo" is needed as well when reading the photo, it is used to find a cached photo and to check the photo
+            if "RN" in self.files:
+                selected_data = self.selected_data.get("RN")
+                if selected_data and "PHOTO" in self.files:
+                    selected_data = list(selected_data) + [ "hash photo" ]
+                card_number = self._reader._read_registre_national(selected_data).card_number
+            else:
+                card_number = self._reader._read_card_number(hash_photo = "PHOTO" in self.files and bool(self._reader.photo_cache or self._reader.verify_photo))
+
+            # Read other files using the card number we already have
+            if "ADDRESS" in self.files:
+                self._reader.read_address(self.selected_data.get("ADDRESS"), card_number)
+            if "PHOTO" in self.files:
+                self._reader.read_photo(card_number)
+        finally:
+            self.apdu_count = self._reader._apdu_count - apdu_count
+
+        self.contact = self._reader._find_contact(card_number)
+        return self.contact
@@ -0,0 +1,193 @@
+from decoder import get_decoder
+from reader import eIDReader
+from connection import eIDCardRemovedError
+from transport import eIDTransport
+import hashlib
+import random
+import time
+
+# Data of the dummy card that is simulated when no data is given
+_DEFAULT_REGISTRE_NATIONAL = {
+    "card number": "592123456789",
+    "chip number": "534c494e33660013931d0c9ab1a7a4f0",
+    "card validity begin": "01.02.2020",
+    "card validity end": "01.02.2030",
+    "card delivery municipality": "Antwerpen",
+    "national number": "85010112345",
+    "name": "Peeters",
+    "two first given names": "Jan Pieter",
+    "first letter of third name": "K",
+    "nationality": "Belg",
+    "birthplace": "Gent",
+    "birthdate": "01 JAN 1985",
+    "sex": "M",
+    "noble condition": "",
+    "document type": "1",
+    "special status": "0",
+}
+_DEFAULT_ADDRESS = {
+    "street": "Kerkstraat 1",
+    "zip_code": "9000",
+    "municipality": "Gent",
+}
+
+# Creates a dummy photo of the given size - starts with FFD8 and ends with FFD9 like a JPG
+def dummy_photo(size = 3063):
+    return bytes([0xFF, 0xD8]) + bytes(index % 251 for index in range(size - 4)) + bytes([0xFF, 0xD9])
+
+# Creates a dummy certificate of the given size - a DER sequence (30 82 length) with data that depends on the file ID
+def _dummy_certificate(file_id, size):
+    body = bytes((file_id + index * 13) % 256 for index in range(size - 4))
+    return bytes([0x30, 0x82, len(body) >> 8, len(body) & 0xFF]) + body
+
+# Simulated eID card - answers SELECT (00 A4 08 0C) and READ BINARY (00 B0) the way the eID chip does for the files of DF01 and the certificates of DF00
+class eIDSimulatedCard:
+
+    # File ID's of the simulated files in DF01
+    REGISTRE_NATIONAL = 0x4031
+    REGISTRE_NATIONAL_SIGNATURE = 0x4032
+    ADDRESS = 0x4033
+    ADDRESS_SIGNATURE = 0x4034
+    PHOTO = 0x4035
+
+    # File ID's of the simulated certificates in DF00
+    AUTHENTICATION_CERTIFICATE = 0x5038
+    SIGNING_CERTIFICATE = 0x5039
+    CA_CERTIFICATE = 0x503A
+    ROOT_CERTIFICATE = 0x503B
+    RRN_CERTIFICATE = 0x503C
+
+    # Directory of the files by the high byte of the file ID
+    _DIRECTORIES = {
+        0x40: [0xDF, 0x01],
+        0x50: [0xDF, 0x00],
+    }
+
+    # Construct - registre_national and address are dictionaries with the value by name (see the mappings of eIDReader)
+    # Values that are not given are taken from a dummy card, the "hash photo" is calculated from the photo (SHA-256)
+    # extended_length is false for a card that rejects extended length READ BINARY commands (0x6700)
+    # max_response_length limits the bytes returned for one extended length command, like a card reader with a small buffer
+    def __init__(self, registre_national = None, address = None, photo = None, extended_length = True, max_response_length = None):
+        photo = photo if photo != None else dummy_photo()
+        registre_national = dict(_DEFAULT_REGISTRE_NATIONAL, **(registre_national or {}))
+        registre_national.setdefault("hash photo", hashlib.sha256(photo).hexdigest())
+        address = dict(_DEFAULT_ADDRESS, **(address or {}))
+
+        self.files = {
+            self.REGISTRE_NATIONAL: get_decoder(eIDReader._REGISTRE_NATIONAL_MAPPING).encode(registre_national),
+            self.ADDRESS: get_decoder(eIDReader._ADDRESS_MAPPING).encode(address),
+            self.PHOTO: photo,
+        }
+
+        # Signatures and certificates are dummy data of a realistic size - certificates start like a DER sequence
+        self.files[self.REGISTRE_NATIONAL_SIGNATURE] = hashlib.sha384(self.files[self.REGISTRE_NATIONAL]).digest() * 2
+        self.files[self.ADDRESS_SIGNATURE] = hashlib.sha384(self.files[self.ADDRESS]).digest() * 2
+        for file_id, size in ((self.AUTHENTICATION_CERTIFICATE, 1270), (self.SIGNING_CERTIFICATE, 1290), (self.CA_CERTIFICATE, 1400), (self.ROOT_CERTIFICATE, 1380), (self.RRN_CERTIFICATE, 1180)):
+            self.files[file_id] = _dummy_certificate(file_id, size)
+        self.extended_length = extended_length
+        self.max_response_length = max_response_length
+        self.inserted = True
+        self._selected = None
+
+    # Methods
+
+    ## Handles an APDU command - returns response, sw1, sw2
+    def transmit(self, apdu):
+        apdu = list(apdu)
+        if len(apdu) < 4 or apdu[0] != 0x00:
+            return [], 0x6E, 0x00
+        match apdu[1]:
+            case 0xA4:
+                return self._select(apdu)
+            case 0xB0:
+                return self._read_binary(apdu)
+            case _:
+                return [], 0x6D, 0x00
+
+    ## Removes the card - the selected file is forgotten
+    def remove(self):
+        self.inserted = False
+        self._selected = None
+
+    ## Inserts the card
+    def insert(self):
+        self.inserted = True
+
+    # Selects a file by path (3F00 DF01 40xx or 3F00 DF00 50xx) - returns 0x9000 or 0x6A82 (file not found)
+    def _select(self, apdu):
+        if apdu[2:4] != [0x08, 0x0C] or len(apdu) < 5 or len(apdu) != 5 + apdu[4]:
+            return [], 0x6A, 0x86
+        path = apdu[5:]
+        if len(path) != 6 or path[:2] != [0x3F, 0x00] or path[2:4] != self._DIRECTORIES.get(path[4]):
+            return [], 0x6A, 0x82
+        file_id = (path[4] << 8) | path[5]
+        if file_id not in self.files:
+            return [], 0x6A, 0x82
+        self._selected = file_id
+        return [], 0x90, 0x00
+
+    # Reads the selected file - returns 0x6Cxx with the amount of bytes left when more bytes are requested than left in the file
+    # An extended length command (Le of 3 bytes) returns the bytes left with 0x6282 (end of file reached) instead
+    def _read_binary(self, apdu):
+        if self._selected == None:
+            return [], 0x69, 0x86
+        data = self.files[self._selected]
+        offset = (apdu[2] << 8) | apdu[3]
+        if offset >= len(data):
+            return [], 0x6B, 0x00
+        if len(apdu) == 7:
+            if not self.extended_length or apdu[4] != 0x00:
+                return [], 0x67, 0x00
+            length = ((apdu[5] << 8) | apdu[6]) or 65536
+            if self.max_response_length and length > self.max_response_length and len(data) - offset > self.max_response_length:
+                return list(data[offset:offset + self.max_response_length]), 0x90, 0x00
+            if length > len(data) - offset:
+                return list(data[offset:]), 0x62, 0x82
+            return list(data[offset:offset + length]), 0x90, 0x00
+        length = (apdu[4] if len(apdu) > 4 else 0) or 256
+        if length > len(data) - offset:
+            return [], 0x6C, (len(data) - offset) & 0xFF
+        return list(data[offset:offset + length]), 0x90, 0x00
+
+# Transport for a simulated card - every APDU takes latency seconds plus or minus a random jitter
+class SimulatedTransport(eIDTransport):
+
+    # Construct - when sleep is false the latency is only added to simulated_seconds instead of waiting
+    # protocol is the simulated protocol ("T0" or "T1") - extended length reads are only tried with T=1
+    def __init__(self, card = None, latency = 0.0, jitter = 0.0, sleep = True, seed = None, name = "Simulated eID reader", protocol = "T0"):
+        self.card = card if card != None else eIDSimulatedCard()
+        self.name = name
+        self._protocol = protocol
+        self._latency = latency
+        self._jitter = jitter
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._connected = False
+
+        # Statistics
+        self.apdu_count = 0
+        self.simulated_seconds = 0.0
+
+    def connect(self, refresh = False):
+        if not self.card.inserted:
+            raise eIDCardRemovedError("Could not connect - no card is inserted.")
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def protocol(self):
+        return self._protocol
+
+    def transmit(self, apdu):
+        if not self._connected or not self.card.inserted:
+            raise eIDCardRemovedError("Transmit failed - not connected to a card.")
+
+        # Simulate the time the card reader and card take to answer
+        delay = max(0.0, self._latency + self._random.uniform(-self._jitter, self._jitter)) if self._latency or self._jitter else 0.0
+        self.simulated_seconds += delay
+        if self._sleep and delay > 0:
+            time.sleep(delay)
+
+        self.apdu_count += 1
+        return self.card.transmit(apdu)
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import datetime
+import os
+import sys
+import threading
+
+# Holds the lock of the store while calling method
+def _locked(method):
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+class eIDContactStore:
+
+    # Construct - max_contacts and ttl (seconds since last read) limit the amount of kept contacts, leave None for no limit
+    # When photo_dir is set, photos are written to that directory and only read from disk when used
+    def __init__(self, max_contacts = None, ttl = None, photo_dir = None):
+        self._max_contacts = max_contacts
+        self._ttl = ttl
+        self._photo_dir = photo_dir
+        if photo_dir:
+            os.makedirs(photo_dir, exist_ok = True)
+
+        # Contacts by card number - ordered from least to most recently read, so the last read contact is the last item
+        self._contacts = OrderedDict()
+        self._evicted = 0
+
+        # Lock of the store - hold it to find, update and save a contact as one step (see eIDReader._crud_contact)
+        self.lock = threading.RLock()
+
+    # Methods
+
+    ## Adds a new contact or marks an existing contact as the last read one - evicts the least recently read contacts when full
+    @_locked
+    def save(self, contact):
+        self._contacts[contact.card_number] = contact
+        self._contacts.move_to_end(contact.card_number)
+        if self._photo_dir:
+            self._spill_photo(contact)
+        self._expire()
+        while self._max_contacts and len(self._contacts) > self._max_contacts:
+            self._evict(next(iter(self._contacts)))
+        return contact
+
+    ## Returns the contact with card_number - returns None if not found
+    @_locked
+    def get(self, card_number):
+        self._expire()
+        return self._contacts.get(card_number)
+
+    ## Returns the last read contact - returns None if nothing is read yet
+    @_locked
+    def last(self):
+        self._expire()
+        if not self._contacts:
+            return None
+        return next(reversed(self._contacts.values()))
+
+    ## Removes the contact with card_number - returns true if removed
+    @_locked
+    def remove(self, card_number):
+        if card_number not in self._contacts:
+            return False
+        self._evict(card_number)
+        self._evicted -= 1
+        return True
+
+    ## Removes all contacts
+    @_locked
+    def clear(self):
+        for card_number in list(self._contacts):
+            self.remove(card_number)
+
+    ## Returns memory usage statistics - sizes are estimates in bytes
+    @_locked
+    def stats(self):
+        self._expire()
+        contacts_bytes = 0
+        photo_bytes = 0
+        spilled_photos = 0
+        for contact in self._contacts.values():
+            contacts_bytes += sys.getsizeof(contact) + sum(sys.getsizeof(getattr(contact, name)) for name in contact.__slots__)
+            photo_bytes += len(contact._photo) + len(contact._photo_base64 or "")
+            spilled_photos += 1 if contact._photo_file else 0
+        return {
+            "contacts": len(self._contacts),
+            "evicted": self._evicted,
+            "memory_bytes": contacts_bytes,
+            "photo_memory_bytes": photo_bytes,
+            "spilled_photos": spilled_photos
+        }
+
+    @_locked
+    def __len__(self):
+        self._expire()
+        return len(self._contacts)
+
+    @_locked
+    def __iter__(self):
+        self._expire()
+        return iter(list(self._contacts.values()))
+
+    @_locked
+    def __contains__(self, card_number):
+        return self.get(card_number) is not None
+
+    # Removes the contacts that were not read within the ttl - the oldest contacts are first, so stop at the first valid one
+    def _expire(self):
+        if not self._ttl:
+            return
+        expire_before = datetime.datetime.now().timestamp() - self._ttl
+        while self._contacts:
+            card_number, contact = next(iter(self._contacts.items()))
+            if contact.updated >= expire_before:
+                break
+            self._evict(card_number)
+
+    # Removes a contact and its spilled photo
+    def _evict(self, card_number):
+        contact = self._contacts.pop(card_number)
+        if contact._photo_file and os.path.exists(contact._photo_file):
+            os.remove(contact._photo_file)
+        self._evicted += 1
+
+    # Writes the photo of a contact to disk and drops it from memory
+    def _spill_photo(self, contact):
+        if not contact._photo:
+            return
+        photo_file = os.path.join(self._photo_dir, f"{contact.card_number}.jpg")
+        with open(photo_file, "wb") as file:
+            file.write(contact._photo)
+        contact._photo = b""
+        contact._photo_base64 = None
+        contact._photo_file = photo_file
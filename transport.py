@@ -0,0 +1,128 @@
+from connection import classify_error, reader_cache, eIDCardRemovedError, eIDReaderGoneError
+
+# Protocols by the name of the PC/SC protocol - pyscard is imported on the first connect, not when importing this module
+_PROTOCOLS = {
+    "SCARD_PROTOCOL_T0": "T0",
+    "SCARD_PROTOCOL_T1": "T1",
+}
+
+# A transport sends APDU commands to a card - eIDReader talks to the card only through a transport
+class eIDTransport:
+
+    # Name of the card reader - used to match card reader events and for statistics
+    name = ""
+
+    # Connects to the card - a connection that was made before is dropped first
+    # Pass refresh to look for card readers again, e.g. after the card reader was unplugged
+    def connect(self, refresh = False):
+        raise NotImplementedError()
+
+    # Connects to the card again - e.g. after the card was removed and inserted, a warm reset where possible
+    def reconnect(self):
+        self.connect()
+
+    # Disconnects from the card - the next connect connects again
+    def disconnect(self):
+        raise NotImplementedError()
+
+    # Returns the active protocol ("T0" or "T1") - returns None if unknown, then only short APDU commands are sent
+    def protocol(self):
+        return None
+
+    # Transmits an APDU command to the card - returns response, sw1, sw2
+    # Raises eIDCardRemovedError, eIDReaderGoneError or eIDTransientError (see connection.py) when transmitting fails
+    def transmit(self, apdu):
+        raise NotImplementedError()
+
+# Transport for a PC/SC card reader using pyscard
+class PyscardTransport(eIDTransport):
+
+    # Construct - pass a reader (from smartcard.System.readers) to bind to that exact reader
+    # Otherwise name is used to find the first card reader that starts with name, leave empty for the first card reader
+    def __init__(self, name = "", reader = None):
+        self._name = name
+        self._bound_reader = reader
+        self.reader = None
+        self._connection = None
+
+    # Name of the connected card reader
+    @property
+    def name(self):
+        return str(self.reader) if self.reader else str(self._bound_reader or "")
+
+    # Connects to the card - this will create a new smartcard object
+    # The card readers are cached (see connection.py), they are only looked up again when refresh is passed or the reader is not found
+    def connect(self, refresh = False):
+        reader = self._find_reader(refresh)
+
+        # Disconnect current reader if a connection was made - a new card maybe inserted
+        self.disconnect()
+
+        # Connect to the card
+        self.reader = reader
+        self._connection = reader.createConnection()
+        try:
+            self._connection.connect()
+        except Exception as e:
+            self._connection = None
+            raise classify_error(e) from e
+
+    # Connects to the card again with a warm reset of the card - no new connection is made and card readers are not looked up again
+    def reconnect(self):
+        if self._connection and hasattr(self._connection, "reconnect"):
+            from smartcard import scard
+            try:
+                self._connection.reconnect(disposition = scard.SCARD_RESET_CARD)
+                return
+            except Exception:
+                pass
+
+        # Card reader can not reconnect (or the card was swapped) - connect again to the same card reader
+        self.connect()
+
+    def disconnect(self):
+        if self._connection:
+            try:
+                self._connection.disconnect()
+            except Exception:
+                pass
+            self._connection = None
+
+    def protocol(self):
+        if not self._connection:
+            return None
+        from smartcard import scard
+        protocol = self._connection.getProtocol()
+        return next((name for constant, name in _PROTOCOLS.items() if getattr(scard, constant, None) == protocol), None)
+
+    def transmit(self, apdu):
+        if not self._connection:
+            raise eIDCardRemovedError("Transmit failed - not connected to a card.")
+        try:
+            return self._connection.transmit(apdu)
+        except Exception as e:
+            raise classify_error(e) from e
+
+    # Finds the card reader to connect to - raises eIDReaderGoneError if not found
+    def _find_reader(self, refresh):
+        found = reader_cache.get(refresh)
+
+        # Check what for reader should be looked for - a bound reader is always reused
+        if self._bound_reader:
+            reader = self._bound_reader if self._bound_reader in found else None
+        elif self._name != "":
+            reader = next((reader for reader in found if reader.name.lower().startswith(self._name.lower())), None)
+        else:
+            reader = found[0] if len(found) > 0 else None
+
+        # Card reader may have been plugged in after the card readers were cached
+        if not reader and not refresh:
+            return self._find_reader(True)
+
+        if not reader:
+            if self._bound_reader:
+                raise eIDReaderGoneError(f"Could not find card reader. Please make sure the card reader '{self._bound_reader}' is plugged in.")
+            if self._name != "":
+                raise eIDReaderGoneError(f"Could not find card reader. Please make sure a card reader that starts with '{self._name.lower()}' is plugged in. The following card readers are found:\n{found}")
+            raise eIDReaderGoneError("Could not find card reader.")
+        return reader